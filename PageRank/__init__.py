@@ -3,10 +3,9 @@
 
 	Originally from: http://www.djangosnippets.org/snippets/221/
 	Modified to fit GAE by mao
+	Fetches through the shared transport module
 	
 """
-from google.appengine.api import urlfetch 
-
 def  IntStr(String, Integer, Factor):
     for i in range(len(String)) :
         Integer *= Factor
@@ -60,14 +59,13 @@ def CheckHash(HashInt):
 
     return '7' + str(CheckByte) + HashStr
 
-def PageRank(URL):
+def PageRankURL(URL):
 	import urllib
 	hsh = CheckHash(HashURL(URL))
-	gurl = 'http://www.google.com/search?client=navclient-auto&features=Rank:&q=info:%s&ch=%s' % (urllib.quote(URL), hsh)
-	
-	f = urlfetch.fetch(gurl)
-	st = f.content
-	st = st.lstrip().rstrip()
+	return 'http://www.google.com/search?client=navclient-auto&features=Rank:&q=info:%s&ch=%s' % (urllib.quote(URL), hsh)
+
+def ParsePageRank(content):
+	st = content.lstrip().rstrip()
 	st = st[9:]
 	try:
 		st = int(st)
@@ -75,4 +73,10 @@ def PageRank(URL):
 		st = 0
 	
 	return st
+
+def PageRank(URL):
+	import transport
+	
+	f = transport.fetch(PageRankURL(URL))
+	return ParsePageRank(f.content)
   
\ No newline at end of file
@@ -0,0 +1,47 @@
+"""
+    Compare the scalar and the bulk Pagerank checksum paths
+
+	python -m PageRank.benchmark [number of urls]
+"""
+import random
+import string
+import sys
+import time
+
+from PageRank import HashURL, CheckHash
+from PageRank import bulk
+
+def make_urls(count):
+    random.seed(0)
+    chars = string.ascii_lowercase + string.digits + '-./'
+    return ['http://www.%s.com/%s' % (''.join(random.choice(chars) for i in range(random.randint(3, 15))),
+                                      ''.join(random.choice(chars) for i in range(random.randint(0, 40))))
+            for n in range(count)]
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+def main(count=20000):
+    urls = make_urls(count)
+
+    expected, scalar = timed(lambda: [CheckHash(HashURL(url)) for url in urls])
+    bulk.memo.clear()
+    result, cold = timed(bulk.checksums, urls)
+    result2, warm = timed(bulk.checksums, urls)
+
+    if result != expected or result2 != expected:
+        print 'MISMATCH between scalar and bulk checksums'
+        return 1
+
+    print '%d urls, numpy %s' % (count, bulk.numpy is not None and 'enabled' or 'not available')
+    print '  scalar         %8.3fs' % scalar
+    print '  bulk (cold)    %8.3fs  %5.1fx' % (cold, scalar / max(cold, 1e-9))
+    print '  bulk (memo)    %8.3fs  %5.1fx' % (warm, scalar / max(warm, 1e-9))
+    return 0
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(main(int(sys.argv[1])))
+    sys.exit(main())
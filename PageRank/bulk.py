@@ -0,0 +1,120 @@
+"""
+    Bulk Pagerank checksums
+
+	checksums(urls) returns the same strings as CheckHash(HashURL(url)) for
+	every url, but computes them a batch at a time: urls are grouped by
+	length and every step of IntStr/HashURL/CheckHash is applied to the
+	whole group with NumPy uint64 arithmetic. Without NumPy it falls back
+	to the scalar functions. Results are memoized in a bounded LRU.
+
+	python -m PageRank.benchmark compares both paths.
+"""
+from PageRank import HashURL, CheckHash
+from tieredcache import LRUCache
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MEMO_SIZE = 100000
+
+memo = LRUCache(MEMO_SIZE)
+
+def checksums(urls):
+    result = [None] * len(urls)
+    todo = {}
+    for i, url in enumerate(urls):
+        hsh = memo.get(url)
+        if hsh is None:
+            todo.setdefault(url, []).append(i)
+        else:
+            result[i] = hsh
+
+    missing = todo.keys()
+    if numpy is not None:
+        computed = vector_checksums(missing)
+    else:
+        computed = [CheckHash(HashURL(url)) for url in missing]
+
+    for url, hsh in zip(missing, computed):
+        memo.set(url, hsh)
+        for i in todo[url]:
+            result[i] = hsh
+    return result
+
+def vector_checksums(urls):
+    ''' checksums of urls without the memo, requires NumPy '''
+    result = [None] * len(urls)
+    bylength = {}
+    for i, url in enumerate(urls):
+        bylength.setdefault(len(url), []).append(i)
+
+    for length, indexes in bylength.items():
+        group = [urls[i] for i in indexes]
+        if any(isinstance(url, unicode) for url in group):
+            codes = numpy.array([[ord(c) for c in url] for url in group], dtype=numpy.uint64)
+        else:
+            codes = numpy.frombuffer(''.join(group), dtype=numpy.uint8).astype(numpy.uint64)
+        codes = codes.reshape(len(group), length)
+        hashes = VectorCheckHash(VectorHashURL(codes))
+        for row, i in enumerate(indexes):
+            result[i] = hashes[row]
+    return result
+
+def VectorIntStr(codes, Start, Factor):
+    # the unmasked sum can exceed 32 bits, so work on uint64 like the scalar code works on longs
+    Integer = numpy.empty(codes.shape[0], dtype=numpy.uint64)
+    Integer.fill(Start)
+    Factor = numpy.uint64(Factor)
+    mask = numpy.uint64(0xFFFFFFFF)
+    for i in range(codes.shape[1]):
+        Integer = ((Integer * Factor) & mask) + codes[:, i]
+    return Integer
+
+def VectorHashURL(codes):
+    u = numpy.uint64
+    C1 = VectorIntStr(codes, 0x1505, 0x21)
+    C2 = VectorIntStr(codes, 0, 0x1003F)
+
+    C1 >>= u(2)
+    C1 = ((C1 >> u(4)) & u(0x3FFFFC0)) | (C1 & u(0x3F))
+    C1 = ((C1 >> u(4)) & u(0x3FFC00)) | (C1 & u(0x3FF))
+    C1 = ((C1 >> u(4)) & u(0x3C000)) | (C1 & u(0x3FFF))
+
+    T1 = (C1 & u(0x3C0)) << u(4)
+    T1 |= C1 & u(0x3C)
+    T1 = (T1 << u(2)) | (C2 & u(0xF0F))
+
+    T2 = (C1 & u(0xFFFFC000)) << u(4)
+    T2 |= C1 & u(0x3C00)
+    T2 = (T2 << u(0xA)) | (C2 & u(0xF0F0000))
+
+    return (T1 | T2)
+
+def VectorCheckHash(HashInts):
+    u = numpy.uint64
+    Flag = numpy.ones(HashInts.shape, dtype=numpy.uint64)
+    CheckByte = numpy.zeros(HashInts.shape, dtype=numpy.uint64)
+
+    # digits from the right, leading zeros add nothing to the sum
+    rest = HashInts.copy()
+    odd = False
+    while rest.any():
+        Byte = rest % u(10)
+        if odd:
+            Byte *= u(2)
+            Byte = Byte // u(10) + Byte % u(10)
+        CheckByte += Byte
+        rest //= u(10)
+        Flag += (rest > 0)
+        odd = not odd
+
+    CheckByte %= u(10)
+    nonzero = CheckByte != 0
+    CheckByte[nonzero] = u(10) - CheckByte[nonzero]
+    fold = nonzero & (Flag % u(2) == 1)
+    CheckByte[fold & (CheckByte % u(2) == 1)] += u(9)
+    CheckByte[fold] >>= u(1)
+
+    return ['7%d%d' % (c, h) for c, h in zip(CheckByte.tolist(), HashInts.tolist())]
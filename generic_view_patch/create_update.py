@@ -1,23 +1,212 @@
-from django.forms.models import ModelFormMetaclass, ModelForm
+import calendar
+import hashlib
+from email.Utils import parsedate_tz, mktime_tz
+
+from django.forms.models import ModelFormMetaclass, ModelForm, modelformset_factory
+from django.forms.formsets import formset_factory
 from django.template import RequestContext, loader
-from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseRedirect, HttpResponseBadRequest, HttpResponseNotModified, QueryDict
+from django.db import transaction, DatabaseError
 from django.core.xheaders import populate_xheaders
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist, ImproperlyConfigured
+from django.forms.util import ValidationError
 from django.utils.translation import ugettext
+from django.utils.http import http_date
+from django.utils.cache import patch_cache_control
+from django.utils.datastructures import MultiValueDict
 from django.contrib.auth.views import redirect_to_login
 from django.views.generic import GenericViewError
 from django.views.generic.create_update import get_model_and_form_class, apply_extra_context, redirect, lookup_object
 
-def apply_extra_fields_and_save(request, extra_fields, form):
-    # No errors -- this means we can save the data!
+# rows written per transaction by the bulk views
+BATCH_SIZE = 100
+
+KEY_OBJECT = 'GENERIC_VIEW_OBJECT_'
+# a suggested object_cache_timeout: edits made outside these views show up after at most this long
+OBJECT_CACHE_TIMEOUT = 30
+
+def object_key(model, field, value):
+    key = '%s.%s|%s|%s' % (model._meta.app_label, model._meta.object_name, field, value)
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    return KEY_OBJECT + hashlib.md5(key).hexdigest()
+
+def get_cached_object(model, object_id, slug, slug_field):
+    if object_id:
+        return cache.get(object_key(model, 'pk', object_id))
+    # slugs are cached as a pointer to the pk, so invalidating the pk is enough
+    pk = cache.get(object_key(model, slug_field, slug))
+    if pk is None:
+        return None
+    obj = cache.get(object_key(model, 'pk', pk))
+    if obj is not None and getattr(obj, slug_field, None) != slug:
+        # the slug was changed since
+        return None
+    return obj
+
+def cache_object(obj, slug, slug_field, timeout):
+    model = obj.__class__
+    cache.set(object_key(model, 'pk', obj.pk), obj, timeout)
+    if slug:
+        cache.set(object_key(model, slug_field, slug), obj.pk, timeout)
+
+def lookup_cached_object(request, model, object_id=None, slug=None, slug_field=None, timeout=0):
+    """
+    lookup_object, remembered for the rest of the request and, with a timeout, in Django's
+    cache for that many seconds. apply_extra_fields_and_save drops saved objects from both.
+    """
+    if object_id:
+        memokey = (model, 'pk', u'%s' % object_id)
+    elif slug and slug_field:
+        memokey = (model, slug_field, slug)
+    else:
+        return lookup_object(model, object_id, slug, slug_field)
+    memo = getattr(request, '_object_cache', None)
+    if memo is None:
+        memo = request._object_cache = {}
+
+    obj = memo.get(memokey)
+    if obj is None and timeout:
+        obj = get_cached_object(model, object_id, slug, slug_field)
+    if obj is None:
+        obj = lookup_object(model, object_id, slug, slug_field)
+        if timeout:
+            cache_object(obj, slug, slug_field, timeout)
+    memo[memokey] = obj
+    return obj
+
+def invalidate_object(request, obj):
+    cache.delete(object_key(obj.__class__, 'pk', obj.pk))
+    memo = getattr(request, '_object_cache', None)
+    if memo:
+        for key, cached in memo.items():
+            if cached.__class__ is obj.__class__ and cached.pk == obj.pk:
+                del memo[key]
+
+def object_etag(request, obj, version_field):
+    """
+    Changes with the object's version_field and, as the form page can show who is logged in,
+    with the user.
+    """
+    user = getattr(request, 'user', None)
+    key = u'%s.%s|%s|%s|%s' % (obj._meta.app_label, obj._meta.object_name, obj.pk,
+                              getattr(obj, version_field), user is not None and user.pk or '')
+    return '"%s"' % hashlib.md5(key.encode('utf-8')).hexdigest()
+
+def object_modified(obj, version_field):
+    """ version_field as a timestamp, None if it isn't a date/time; naive values are taken as UTC """
+    value = getattr(obj, version_field)
+    if hasattr(value, 'utctimetuple'):
+        return calendar.timegm(value.utctimetuple())
+    if hasattr(value, 'timetuple'):
+        return calendar.timegm(value.timetuple())
+    return None
+
+def not_modified(request, etag, modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        # If-None-Match wins over If-Modified-Since when both are sent
+        etags = [tag.strip() for tag in if_none_match.split(',')]
+        return etag in etags or '*' in etags
+    if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since and modified is not None:
+        since = parsedate_tz(if_modified_since.split(';')[0])
+        return since is not None and mktime_tz(since) >= modified
+    return False
+
+def resolve_extra_fields(request, extra_fields):
     if callable(extra_fields) : extra_fields = extra_fields(request)            
     if extra_fields is None : extra_fields = {}
-    
+    return extra_fields
+
+def apply_extra_fields(extra_fields, form):
     new_object = form.save(commit = False)
     for k, v in extra_fields.items():
         setattr(new_object, k, v)
+    return new_object
+
+def apply_extra_fields_and_save(request, extra_fields, form):
+    # No errors -- this means we can save the data!
+    new_object = apply_extra_fields(resolve_extra_fields(request, extra_fields), form)
     new_object.save()
+    invalidate_object(request, new_object)
     return new_object
+
+def save_batch(model, objects, create):
+    if create and hasattr(model._default_manager, 'bulk_create'):
+        # one INSERT for the whole batch; no save() signals and, on most databases, no pks
+        model._default_manager.bulk_create(objects)
+    else:
+        for obj in objects:
+            obj.save()
+
+def save_in_batches(model, objects, batch_size=BATCH_SIZE, create=False):
+    """
+    Save objects batch_size at a time, each batch in its own transaction. A batch the database
+    rejects is rolled back and reported, the others are still saved.
+    Returns (saved objects, [(object, error), ...]).
+    """
+    saved = []
+    failed = []
+    for i in range(0, len(objects), batch_size):
+        batch = objects[i:i + batch_size]
+        try:
+            transaction.commit_on_success(save_batch)(model, batch, create)
+        except DatabaseError, e:
+            failed.extend([(obj, e) for obj in batch])
+        else:
+            saved.extend(batch)
+    return saved, failed
+
+def split_forms(forms):
+    """
+    Returns (valid forms, [(row number, form), ...] of invalid ones); rows left empty are skipped.
+    """
+    valid = []
+    invalid = []
+    for i, form in enumerate(forms):
+        if not form.has_changed():
+            continue
+        if form.is_valid():
+            valid.append(form)
+        else:
+            invalid.append((i + 1, form))
+    return valid, invalid
+
+def rebind_formset(formset_class, data, files, forms):
+    """
+    A formset bound to the submitted data of forms only, renumbered, so that the rows that
+    were saved aren't submitted again.
+    """
+    formset = formset_class()
+    bound = QueryDict('', mutable=True)
+    bound_files = MultiValueDict()
+    for i, form in enumerate(forms):
+        for name in form.fields:
+            old_key = form.add_prefix(name)
+            new_key = '%s-%s-%s' % (formset.prefix, i, name)
+            bound.setlist(new_key, data.getlist(old_key))
+            # uploads are keyed by the old prefix too, or the file fields would come back empty
+            if old_key in files:
+                bound_files.setlist(new_key, files.getlist(old_key))
+    bound['%s-TOTAL_FORMS' % formset.prefix] = str(len(forms))
+    bound['%s-INITIAL_FORMS' % formset.prefix] = '0'
+    return formset_class(bound, bound_files)
+
+def render_bulk_form(request, model, template_name, template_loader, extra_context, context_processors,
+                     formset, saved, invalid, failed):
+    if not template_name:
+        template_name = "%s/%s_bulk_form.html" % (model._meta.app_label, model._meta.object_name.lower())
+    t = template_loader.get_template(template_name)
+    c = RequestContext(request, {
+        'formset': formset,
+        'saved_objects': saved,
+        'invalid_rows': invalid,
+        'failed_objects': failed,
+    }, context_processors)
+    apply_extra_context(extra_context, c)
+    return HttpResponse(t.render(c))
             
 def create_object(request, model=None, template_name=None, extra_fields = None,
         template_loader=loader, extra_context=None, post_save_redirect=None,
@@ -60,10 +249,19 @@ def update_object(request, model=None, object_id=None, slug=None,
         slug_field='slug', template_name=None, template_loader=loader,
         extra_context=None, post_save_redirect=None, login_required=False,
         context_processors=None, template_object_name='object', extra_fields = None, 
-        form_class=None):
+        form_class=None, version_field=None, object_cache_timeout=0):
     """
     Generic object-update function.
 
+    With version_field, the name of a field that changes on every save (a
+    last modified timestamp or a version counter), GETs are answered with an
+    ETag and, for a date/time field, a Last-Modified header, and a client
+    that already has the current page gets a 304 without the form being
+    rendered. object_cache_timeout keeps the object in Django's cache for
+    that many seconds (see OBJECT_CACHE_TIMEOUT); saves through these views
+    invalidate it, edits made elsewhere show up once it times out. Form
+    submissions always edit a freshly loaded object.
+
     Templates: ``<app_label>/<model_name>_form.html``
     Context:
         form
@@ -76,9 +274,9 @@ def update_object(request, model=None, object_id=None, slug=None,
         return redirect_to_login(request.path)
 
     model, form_class = get_model_and_form_class(model, form_class)
-    obj = lookup_object(model, object_id, slug, slug_field)
 
     if request.method == 'POST':
+        obj = lookup_object(model, object_id, slug, slug_field)
         form = form_class(request.POST, request.FILES, instance=obj)
         if form.is_valid():
             obj = apply_extra_fields_and_save(request, extra_fields, form)
@@ -87,6 +285,14 @@ def update_object(request, model=None, object_id=None, slug=None,
 #                request.user.message_set.create(message=ugettext("The %(verbose_name)s was updated successfully.") % {"verbose_name": model._meta.verbose_name})
             return redirect(post_save_redirect, obj)
     else:
+        obj = lookup_cached_object(request, model, object_id, slug, slug_field, object_cache_timeout)
+        if version_field:
+            etag = object_etag(request, obj, version_field)
+            modified = object_modified(obj, version_field)
+            if not_modified(request, etag, modified):
+                response = HttpResponseNotModified()
+                response['ETag'] = etag
+                return response
         form = form_class(instance=obj)
 
     if not template_name:
@@ -99,4 +305,115 @@ def update_object(request, model=None, object_id=None, slug=None,
     apply_extra_context(extra_context, c)
     response = HttpResponse(t.render(c))
     populate_xheaders(request, response, model, getattr(obj, obj._meta.pk.attname))
+    if version_field and request.method != 'POST':
+        response['ETag'] = etag
+        if modified is not None:
+            response['Last-Modified'] = http_date(modified)
+        # revalidate every time, and only the user's own browser may keep it
+        patch_cache_control(response, private=True, max_age=0, must_revalidate=True)
     return response
+
+def bulk_create_objects(request, model=None, template_name=None, extra_fields = None,
+        template_loader=loader, extra_context=None, post_save_redirect=None,
+        login_required=False, context_processors=None, form_class=None,
+        extra=10, batch_size=BATCH_SIZE):
+    """
+    Generic creation of many objects at once from a formset of ``extra`` rows.
+
+    Every filled in row is validated, extra_fields is resolved once for all of
+    them, and the valid rows are written batch_size at a time, one transaction
+    per batch. Invalid rows don't stop the valid ones from being saved: they
+    are shown again, on their own, with their errors, as are the rows of the
+    batches the database rejected. If everything was saved and
+    post_save_redirect is given, redirects there.
+
+    Templates: ``<app_label>/<model_name>_bulk_form.html``
+    Context:
+        formset
+            the formset of the rows still to submit
+        saved_objects
+            the objects created by this request
+        invalid_rows
+            (row number, form) of the rows that didn't validate
+        failed_objects
+            (object, error) of the rows the database rejected
+    """
+    if extra_context is None: extra_context = {}
+    if login_required and not request.user.is_authenticated():
+        return redirect_to_login(request.path)
+
+    model, form_class = get_model_and_form_class(model, form_class)
+    formset_class = formset_factory(form_class, extra=extra)
+    saved = invalid = failed = []
+    if request.method == 'POST':
+        try:
+            formset = formset_class(request.POST, request.FILES)
+            forms = formset.forms
+        except ValidationError, e:
+            # the management form is missing or broken
+            return HttpResponseBadRequest(' '.join(e.messages))
+        valid, invalid = split_forms(forms)
+        extra_fields = resolve_extra_fields(request, extra_fields)
+        objects = [apply_extra_fields(extra_fields, form) for form in valid]
+        saved, failed = save_in_batches(model, objects, batch_size, create=True)
+        if not invalid and not failed and post_save_redirect:
+            return HttpResponseRedirect(post_save_redirect)
+        if saved:
+            # the invalid rows and the rows of the rejected batches, in the order they were submitted
+            # (by identity: unsaved objects all compare equal)
+            failed_ids = set([id(obj) for obj, error in failed])
+            resubmit = set([id(form) for row, form in invalid])
+            resubmit.update([id(form) for form, obj in zip(valid, objects) if id(obj) in failed_ids])
+            formset = rebind_formset(formset_class, request.POST, request.FILES,
+                                     [form for form in forms if id(form) in resubmit])
+    else:
+        formset = formset_class()
+
+    return render_bulk_form(request, model, template_name, template_loader, extra_context, context_processors,
+                            formset, saved, invalid, failed)
+
+def bulk_update_objects(request, model=None, queryset=None, template_name=None, extra_fields = None,
+        template_loader=loader, extra_context=None, post_save_redirect=None,
+        login_required=False, context_processors=None, form_class=None,
+        batch_size=BATCH_SIZE):
+    """
+    Generic update of many objects at once, one formset row per object of
+    ``queryset`` (all objects of the model by default).
+
+    Only rows that were changed are validated and saved, extra_fields is
+    resolved once, and the valid rows are written batch_size at a time in one
+    transaction per batch; invalid rows are reported without stopping the
+    others. If everything was saved and post_save_redirect is given,
+    redirects there.
+
+    Templates: ``<app_label>/<model_name>_bulk_form.html``
+    Context: as for bulk_create_objects
+    """
+    if extra_context is None: extra_context = {}
+    if login_required and not request.user.is_authenticated():
+        return redirect_to_login(request.path)
+
+    model, form_class = get_model_and_form_class(model, form_class)
+    if queryset is None:
+        queryset = model._default_manager.all()
+    formset_class = modelformset_factory(model, form=form_class, extra=0)
+    saved = invalid = failed = []
+    if request.method == 'POST':
+        try:
+            formset = formset_class(request.POST, request.FILES, queryset=queryset)
+            forms = formset.forms
+        except ValidationError, e:
+            # the management form is missing or broken
+            return HttpResponseBadRequest(' '.join(e.messages))
+        valid, invalid = split_forms(forms)
+        extra_fields = resolve_extra_fields(request, extra_fields)
+        saved, failed = save_in_batches(model, [apply_extra_fields(extra_fields, form) for form in valid], batch_size)
+        for obj in saved:
+            invalidate_object(request, obj)
+        if not invalid and not failed and post_save_redirect:
+            return HttpResponseRedirect(post_save_redirect)
+    else:
+        formset = formset_class(queryset=queryset)
+
+    return render_bulk_form(request, model, template_name, template_loader, extra_context, context_processors,
+                            formset, saved, invalid, failed)
@@ -0,0 +1,327 @@
+'''
+Offline build of the combined media bundles.
+
+    python -m mediabuild.build [--force] [output dir]
+
+(with DJANGO_SETTINGS_MODULE pointing at the project's settings)
+The bundles are the ones the apps register with ragendja's add_app_media,
+i.e. settings.COMBINE_MEDIA; names and files may use %(LANGUAGE_CODE)s and
+%(LANGUAGE_DIR)s, which are expanded for every language in
+settings.LANGUAGES. Each bundle is concatenated in the declared order,
+minified and written as <name>.<content hash>.<ext>, next to a .gz and,
+when the brotli module is installed, a .br copy. Relative url()s in
+stylesheets are rewritten to the app media they point at, as the bundle
+lives elsewhere. Files ragendja generates instead of reading (names starting
+with a dot, like .site_data.js) come from settings.MEDIA_BUILD_GENERATED;
+the build fails on one that isn't listed there.
+
+manifest.json maps every bundle name to its current file and the digest
+of its inputs; a bundle whose inputs didn't change since the last build
+is left alone. The previous file of a rebuilt bundle is kept, for pages
+still cached with the old name, the one before that is deleted.
+
+Stylesheets can be pruned to the rules the project's templates use, and
+critical CSS bundles built for layouts; see mediabuild.prune.
+
+The output dir defaults to settings.MEDIA_BUILD_ROOT (MEDIA_ROOT/build),
+and {% asset %} from the assets template tag library looks names up in
+its manifest.
+'''
+
+import gzip
+import hashlib
+import logging
+import os
+import posixpath
+import re
+import sys
+import urlparse
+from cStringIO import StringIO
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from django.conf import settings
+from django.core.urlresolvers import get_callable
+from django.core.exceptions import ViewDoesNotExist
+from django.utils import simplejson
+
+from mediabuild import minify, prune
+
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 12
+# bump when the output for the same inputs changes, so that everything is rebuilt
+BUILD_VERSION = 1
+
+MINIFIERS = {
+    '.css': minify.minify_css,
+    '.js': minify.minify_js,
+}
+# what goes between two files of a bundle; the ; ends a script that relied on a final line break
+SEPARATORS = {
+    '.css': '\n',
+    '.js': ';\n',
+}
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'"\)]+)\1\s*\)''')
+
+class BuildError(Exception):
+    pass
+
+def build_root():
+    return getattr(settings, 'MEDIA_BUILD_ROOT', None) or os.path.join(settings.MEDIA_ROOT, 'build')
+
+def build_url():
+    return getattr(settings, 'MEDIA_BUILD_URL', None) or settings.MEDIA_URL + 'build/'
+
+def language_dir(code):
+    return code.split('-')[0] in getattr(settings, 'LANGUAGES_BIDI', ()) and 'rtl' or 'ltr'
+
+def expand(name, code):
+    if '%(' not in name:
+        return name
+    return name % {'LANGUAGE_CODE': code, 'LANGUAGE_DIR': language_dir(code)}
+
+def get_bundles(combine_media=None, languages=None):
+    ''' {bundle name: [media path, ...]} with the language placeholders expanded '''
+    if combine_media is None:
+        combine_media = getattr(settings, 'COMBINE_MEDIA', {})
+    if languages is None:
+        languages = [code for code, name in settings.LANGUAGES]
+    bundles = {}
+    for name, files in combine_media.items():
+        for code in languages:
+            bundles[expand(name, code)] = [expand(f, code) for f in files]
+    return bundles
+
+def source(path):
+    '''
+    (file name, URL) of a media path: 'app/file' is the app's media/file, served from
+    MEDIA_URL/app/file; paths that don't start with an app are taken from MEDIA_ROOT.
+    '''
+    app, rest = path.split('/', 1)
+    if rest.startswith('media/'):
+        rest = rest[len('media/'):]
+    try:
+        module = __import__(app, {}, {}, [''])
+    except ImportError:
+        return os.path.join(settings.MEDIA_ROOT, *path.split('/')), settings.MEDIA_URL + path
+    return (os.path.join(os.path.dirname(module.__file__), 'media', *rest.split('/')),
+            '%s%s/%s' % (settings.MEDIA_URL, app, rest))
+
+def rebase_urls(css, url):
+    ''' Make the relative url()s of a stylesheet served from url absolute '''
+    def rebase(match):
+        target = match.group(2).strip()
+        if target.startswith(('/', '#', 'data:')) or urlparse.urlsplit(target)[0]:
+            return match.group(0)
+        return 'url(%s)' % urlparse.urljoin(url, target)
+    return CSS_URL.sub(rebase, css)
+
+def generated(name, path):
+    '''
+    Content of a file ragendja generates rather than reads (e.g. .site_data.js), from the
+    function settings.MEDIA_BUILD_GENERATED maps it to; None if it's mapped to None, i.e.
+    deliberately left out
+    '''
+    handlers = getattr(settings, 'MEDIA_BUILD_GENERATED', {})
+    if path not in handlers:
+        raise BuildError('%s: %s is generated, add it to MEDIA_BUILD_GENERATED' % (name, path))
+    handler = handlers[path]
+    if handler is None:
+        logging.warning('mediabuild: %s: leaving out %s' % (name, path))
+        return None
+    try:
+        content = get_callable(handler)()
+    except (ImportError, ViewDoesNotExist), e:
+        raise BuildError('%s: %s: %s' % (name, path, e))
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+    return content
+
+def read_inputs(name, paths):
+    ''' [(media path, URL, content), ...] of a bundle '''
+    inputs = []
+    for path in paths:
+        if path.startswith('.'):
+            content = generated(name, path)
+            if content is not None:
+                inputs.append((path, build_url() + path, content))
+            continue
+        filename, url = source(path)
+        try:
+            inputs.append((path, url, open(filename, 'rb').read()))
+        except IOError, e:
+            raise BuildError('%s: %s' % (name, e))
+    return inputs
+
+def digest(name, inputs, usage=None):
+    md5 = hashlib.md5('%s|%s|%s' % (BUILD_VERSION, minify.minifiers(), name))
+    if usage is not None:
+        md5.update('|' + usage.signature())
+    for path, url, content in inputs:
+        md5.update('|%s|%d|' % (path, len(content)))
+        md5.update(content)
+    return md5.hexdigest()
+
+def combine(name, inputs, usage=None, minified=True):
+    ''' The bundle's content; stylesheets in MEDIA_BUILD_PRUNE are pruned to usage if one is given '''
+    ext = posixpath.splitext(name)[1]
+    minifier = minified and MINIFIERS.get(ext) or None
+    parts = []
+    for path, url, content in inputs:
+        if ext == '.css':
+            content = rebase_urls(content, url)
+            if usage is not None and prune.should_prune(path):
+                content = prune.prune_css(content, usage)
+        if minifier is not None:
+            try:
+                content = minifier(content)
+            except ValueError, e:
+                raise BuildError('%s: %s: %s' % (name, path, e))
+        parts.append(content)
+    return SEPARATORS.get(ext, '\n').join(parts)
+
+def critical(name, inputs, usage):
+    ''' The critical CSS of a bundle for the layout usage '''
+    try:
+        return minify.minify_css(prune.critical_css(combine(name, inputs, minified=False), usage, name=name))
+    except ValueError, e:
+        raise BuildError('%s: %s' % (name, e))
+
+def hashed_name(name, content):
+    base, ext = posixpath.splitext(name)
+    return '%s.%s%s' % (base, hashlib.md5(content).hexdigest()[:HASH_LENGTH], ext)
+
+def gzip_compress(content):
+    buf = StringIO()
+    # a fixed mtime keeps the output the same for the same content
+    f = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9, mtime=0)
+    f.write(content)
+    f.close()
+    return buf.getvalue()
+
+def write(path, content):
+    tmp = path + '.tmp'
+    f = open(tmp, 'wb')
+    try:
+        f.write(content)
+    finally:
+        f.close()
+    os.rename(tmp, path)
+
+def write_bundle(root, filename, content):
+    write(os.path.join(root, filename), content)
+    write(os.path.join(root, filename + '.gz'), gzip_compress(content))
+    if brotli is not None:
+        write(os.path.join(root, filename + '.br'), brotli.compress(content))
+
+def remove_bundle(root, filename):
+    for suffix in ('', '.gz', '.br'):
+        try:
+            os.remove(os.path.join(root, filename + suffix))
+        except OSError:
+            pass
+
+def load_manifest(root):
+    try:
+        return simplejson.load(open(os.path.join(root, MANIFEST)))
+    except (IOError, ValueError):
+        return {}
+
+def store(root, manifest, name, content, inputs_digest):
+    filename = hashed_name(name, content)
+    write_bundle(root, filename, content)
+    entry = manifest.get(name)
+    previous = entry and entry.get('previous') or None
+    if entry and entry['file'] != filename:
+        # keep the file being replaced, drop the one before it
+        if previous and previous != filename:
+            remove_bundle(root, previous)
+        previous = entry['file']
+    manifest[name] = {
+        'file': filename,
+        'digest': inputs_digest,
+        'previous': previous,
+        'size': len(content),
+    }
+    logging.info('mediabuild: %s -> %s (%d bytes)' % (name, filename, len(content)))
+
+def is_current(root, manifest, name, inputs_digest):
+    entry = manifest.get(name)
+    return entry and entry['digest'] == inputs_digest and os.path.exists(os.path.join(root, entry['file']))
+
+def build(root=None, bundles=None, force=False, critical_bundles=None):
+    '''
+    Build every bundle (and critical CSS bundle, see mediabuild.prune) whose inputs changed,
+    returns (built, unchanged) bundle names
+    '''
+    if root is None:
+        root = build_root()
+    if bundles is None:
+        bundles = get_bundles()
+    if critical_bundles is None:
+        critical_bundles = prune.critical_bundles()
+    if not os.path.isdir(root):
+        os.makedirs(root)
+
+    usage = None
+    if prune.prune_paths():
+        usage = prune.scan_templates()
+
+    manifest = load_manifest(root)
+    built = []
+    unchanged = []
+    for name in sorted(bundles):
+        inputs = read_inputs(name, bundles[name])
+        pruned = [path for path, url, content in inputs if usage is not None and prune.should_prune(path)]
+        inputs_digest = digest(name, inputs, pruned and usage or None)
+        if not force and is_current(root, manifest, name, inputs_digest):
+            unchanged.append(name)
+            continue
+        store(root, manifest, name, combine(name, inputs, usage), inputs_digest)
+        built.append(name)
+
+    layouts = {}
+    for name in sorted(critical_bundles):
+        bundle, layout = critical_bundles[name]
+        if bundle not in bundles:
+            raise BuildError('%s: no bundle %s' % (name, bundle))
+        if layout not in layouts:
+            layouts[layout] = prune.scan_layout(layout)
+        inputs = read_inputs(name, bundles[bundle])
+        inputs_digest = digest(name, inputs, layouts[layout])
+        if not force and is_current(root, manifest, name, inputs_digest):
+            unchanged.append(name)
+            continue
+        store(root, manifest, name, critical(name, inputs, layouts[layout]), inputs_digest)
+        built.append(name)
+
+    # entries of bundles that are gone no longer count
+    for name in manifest.keys():
+        if name not in bundles and name not in critical_bundles:
+            del manifest[name]
+    write(os.path.join(root, MANIFEST), simplejson.dumps(manifest, indent=1, sort_keys=True))
+    return built, unchanged
+
+def main(argv):
+    args = argv[1:]
+    force = '--force' in args
+    args = [a for a in args if a != '--force']
+    root = args and args[0] or None
+    try:
+        built, unchanged = build(root, force=force)
+    except BuildError, e:
+        print >>sys.stderr, 'mediabuild: %s' % e
+        return 1
+    for name in built:
+        print 'built     %s' % name
+    for name in unchanged:
+        print 'unchanged %s' % name
+    return 0
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv))
@@ -0,0 +1,194 @@
+'''
+CSS and JavaScript minifiers for the media build.
+
+rcssmin / rjsmin are used when they're installed; otherwise the pure Python
+fallbacks below do the job: minify_css drops comments and redundant
+whitespace, minify_js is a port of Douglas Crockford's jsmin. Both keep
+/*! ... */ comments (licenses) and never touch string contents.
+'''
+
+import re
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+def minifiers():
+    ''' Which minifiers are in use, part of the build digest '''
+    return 'css:%s js:%s' % (rcssmin and 'rcssmin' or 'builtin', rjsmin and 'rjsmin' or 'jsmin')
+
+CSS_TOKENS = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|(/\*.*?\*/)''', re.S)
+CSS_PLACEHOLDER = re.compile(r'\x00(\d+)\x00')
+
+def minify_css(css):
+    if rcssmin is not None:
+        return rcssmin.cssmin(css, keep_bang_comments=True)
+
+    kept = []
+    def keep(match):
+        string, comment = match.groups()
+        if comment is not None and not comment.startswith('/*!'):
+            return ' '
+        kept.append(string or comment + '\n')
+        return '\x00%d\x00' % (len(kept) - 1)
+    css = CSS_TOKENS.sub(keep, css)
+
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r' ?([{};,>]) ?', r'\1', css)
+    css = re.sub(r': ', ':', css)
+    css = re.sub(r' ?!important', '!important', css)
+    css = css.replace(';}', '}')
+    # rules left empty, e.g. by a comment that was their only content
+    css = re.sub(r'(^|[{}])[^{}\x00]+\{\}', r'\1', css)
+    return CSS_PLACEHOLDER.sub(lambda m: kept[int(m.group(1))], css).strip() + '\n'
+
+def minify_js(js):
+    if rjsmin is not None:
+        return rjsmin.jsmin(js, keep_bang_comments=True)
+    return JSMin(js).minify()
+
+class UnterminatedError(ValueError):
+    pass
+
+def is_alphanum(c):
+    return c != '' and (c.isalnum() or c in '_$\\' or ord(c) > 126)
+
+class JSMin(object):
+    '''
+    jsmin: removes comments and the whitespace JavaScript doesn't need, keeps line breaks
+    where semicolon insertion might depend on them.
+    '''
+    # after one of these a / starts a regular expression, not a division
+    REGEXP_PREFIX = '(,=:[!&|?+-~*{;\n'
+
+    def __init__(self, js):
+        self.input = js
+        self.pos = 0
+        self.lookahead = None
+        self.out = []
+
+    def get(self):
+        c = self.lookahead
+        self.lookahead = None
+        if c is None:
+            if self.pos >= len(self.input):
+                return ''
+            c = self.input[self.pos]
+            self.pos += 1
+        if c >= ' ' or c == '\n' or c == '':
+            return c
+        if c == '\r':
+            return '\n'
+        return ' '
+
+    def peek(self):
+        self.lookahead = self.get()
+        return self.lookahead
+
+    def next(self):
+        c = self.get()
+        if c != '/':
+            return c
+        p = self.peek()
+        if p == '/':
+            while c > '\n':
+                c = self.get()
+            return c
+        if p == '*':
+            self.get()
+            comment = ['/*']
+            while True:
+                c = self.get()
+                if c == '':
+                    raise UnterminatedError('unterminated comment')
+                comment.append(c)
+                if c == '*' and self.peek() == '/':
+                    comment.append(self.get())
+                    break
+            if comment[1:2] == ['!']:
+                self.out.append(''.join(comment) + '\n')
+            return ' '
+        return c
+
+    def action(self, d):
+        if d <= 1:
+            self.out.append(self.a)
+        if d <= 2:
+            self.a = self.b
+            if self.a in ('"', "'"):
+                while True:
+                    self.out.append(self.a)
+                    self.a = self.get()
+                    if self.a == self.b:
+                        break
+                    if self.a == '\\':
+                        self.out.append(self.a)
+                        self.a = self.get()
+                    if self.a == '' or self.a == '\n' and self.out[-1] != '\\':
+                        raise UnterminatedError('unterminated string literal')
+        self.b = self.next()
+        if self.b == '/' and self.a and self.a in self.REGEXP_PREFIX:
+            self.out.append(self.a)
+            if self.a in '/*':
+                self.out.append(' ')
+            self.out.append(self.b)
+            while True:
+                self.a = self.get()
+                if self.a == '[':
+                    while True:
+                        self.out.append(self.a)
+                        self.a = self.get()
+                        if self.a == ']':
+                            break
+                        if self.a == '\\':
+                            self.out.append(self.a)
+                            self.a = self.get()
+                        if self.a == '':
+                            raise UnterminatedError('unterminated set in regular expression')
+                elif self.a == '/':
+                    break
+                elif self.a == '\\':
+                    self.out.append(self.a)
+                    self.a = self.get()
+                if self.a == '' or self.a == '\n':
+                    raise UnterminatedError('unterminated regular expression')
+                self.out.append(self.a)
+            self.b = self.next()
+
+    def minify(self):
+        self.a = '\n'
+        self.action(3)
+        while self.a != '':
+            a, b = self.a, self.b
+            if a == ' ':
+                if is_alphanum(b) or (b in '+-' and b and self.out[-1:] == [b]):
+                    self.action(1)
+                else:
+                    self.action(2)
+            elif a == '\n':
+                if b in '{[(+-!~' and b:
+                    self.action(1)
+                elif b == ' ':
+                    self.action(3)
+                else:
+                    self.action(is_alphanum(b) and 1 or 2)
+            elif b == ' ':
+                # keep "a + +b" and "a - -b" apart
+                if is_alphanum(a) or (a in '+-' and self.peek() == a):
+                    self.action(1)
+                else:
+                    self.action(3)
+            elif b == '\n':
+                if a in '}])+-"\'' or is_alphanum(a):
+                    self.action(1)
+                else:
+                    self.action(3)
+            else:
+                self.action(1)
+        return ''.join(self.out).lstrip('\n') + '\n'
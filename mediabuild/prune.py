@@ -0,0 +1,443 @@
+'''
+Unused rule pruning and critical CSS for the media build.
+
+The project's templates (settings.TEMPLATE_DIRS and every installed app's
+templates/ directory) are scanned for the classes, ids and elements they
+use. Template syntax is taken out first: {% %} tags count as whitespace, so
+class="{% if first %}first {% endif %}span-8" uses "first" and "span-8",
+and a {{ variable }} inside a name keeps every name starting with the part
+before it (class="span-{{ width }}" keeps all of .span-*). Names set from
+{{ variables }} alone or by JavaScript can't be found this way and have to
+be safelisted.
+
+    MEDIA_BUILD_PRUNE = ('blueprintcss/',)
+    MEDIA_BUILD_SAFELIST = ('.error', '.notice', '.success', '#flash', '.push-*', 'table')
+
+prunes the stylesheets of every bundle whose media path starts with one of
+the MEDIA_BUILD_PRUNE prefixes: a selector stays if each class, id and
+element in it is used or safelisted (attribute selectors and pseudo-classes
+are assumed to match), a rule stays if any of its selectors does.
+
+    MEDIA_BUILD_CRITICAL = {
+        'critical-%(LANGUAGE_DIR)s.css': ('combined-%(LANGUAGE_DIR)s.css', 'base.html'),
+    }
+
+builds, next to the bundles, the rules of a bundle that the markup of a
+layout template needs: the layout itself up to a {# fold #} comment (the
+whole of it without one) and the templates it {% include %}s there, at most
+CRITICAL_MAX bytes. A layout that {% extends %} another one is taken as the
+parent with the layout's blocks filled in, so the fold can be in either.
+Rules that no longer fit are left out, with a warning. The layout inlines
+it and loads the full bundle without blocking rendering:
+
+    {% load assets %}
+    <style>{% inline_asset "critical-%(LANGUAGE_DIR)s.css" %}</style>
+    {% async_stylesheet "combined-%(LANGUAGE_DIR)s.css" %}
+
+    python -m mediabuild.prune
+
+reports how much pruning takes off each stylesheet, without building.
+'''
+
+import logging
+import os
+import re
+import sys
+
+from django.conf import settings
+
+TEMPLATE_EXTENSIONS = ('.html', '.htm', '.txt', '.xml')
+# what fits the first round trip of a new connection, along with the page head
+CRITICAL_MAX = 14 * 1024
+FOLD_MARKER = '{# fold #}'
+MAX_INCLUDE_DEPTH = 5
+
+ALWAYS_USED = ('html', 'body', '*')
+
+TEMPLATE_COMMENT = re.compile(r'\{#.*?#\}|\{%\s*comment\s*%\}.*?\{%\s*endcomment\s*%\}', re.S)
+TEMPLATE_TAG = re.compile(r'\{%.*?%\}', re.S)
+TEMPLATE_VARIABLE = re.compile(r'\{\{.*?\}\}', re.S)
+INCLUDE = re.compile(r'''\{%\s*include\s+["']([^"']+)["']''')
+EXTENDS = re.compile(r'''\{%\s*extends\s+["']([^"']+)["']''')
+BLOCK_TAG = re.compile(r'\{%\s*(?:block\s+(\w+)|endblock(?:\s+\w+)?)\s*%\}')
+BLOCK_SUPER = re.compile(r'\{\{\s*block\.super\s*\}\}')
+MARKUP_TAG = re.compile(r'<([a-zA-Z][a-zA-Z0-9]*)([^>]*)>')
+ATTRIBUTE = re.compile(r'''(?:^|\s)(class|id)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))''', re.I)
+# stands in for a {{ variable }}
+DYNAMIC = '\x01'
+
+class Usage(object):
+    ''' The classes, ids and element names a set of templates uses '''
+
+    def __init__(self, safelist=()):
+        self.names = {'.': set(), '#': set(), '': set(ALWAYS_USED)}
+        self.prefixes = {'.': set(), '#': set(), '': set()}
+        for entry in safelist:
+            self.add_selector(entry)
+
+    def add(self, kind, name):
+        if kind == '':
+            name = name.lower()
+        if DYNAMIC in name:
+            name = name.split(DYNAMIC)[0]
+            if name:
+                self.prefixes[kind].add(name)
+        elif name:
+            self.names[kind].add(name)
+
+    def add_selector(self, entry):
+        ''' '.name', '#name' or 'element', a trailing * matches every name starting with the rest '''
+        kind = entry[:1] in ('.', '#') and entry[:1] or ''
+        name = entry[len(kind):]
+        if name.endswith('*') and name != '*':
+            self.prefixes[kind].add(name[:-1])
+        else:
+            self.names[kind].add(kind == '' and name.lower() or name)
+
+    def uses(self, kind, name):
+        if kind == '':
+            name = name.lower()
+        if name in self.names[kind]:
+            return True
+        for prefix in self.prefixes[kind]:
+            if name.startswith(prefix):
+                return True
+        return False
+
+    def signature(self):
+        ''' Changes whenever the usage does, for the build digest '''
+        parts = []
+        for kind in ('.', '#', ''):
+            parts.append(' '.join(sorted(self.names[kind])))
+            parts.append(' '.join(sorted(self.prefixes[kind])))
+        return '|'.join(parts)
+
+def strip_template(source):
+    source = TEMPLATE_COMMENT.sub(' ', source)
+    source = TEMPLATE_VARIABLE.sub(DYNAMIC, source)
+    return TEMPLATE_TAG.sub(' ', source)
+
+def scan_markup(source, usage):
+    for match in MARKUP_TAG.finditer(strip_template(source)):
+        usage.add('', match.group(1))
+        for attribute in ATTRIBUTE.finditer(match.group(2)):
+            kind = attribute.group(1).lower() == 'class' and '.' or '#'
+            value = [v for v in attribute.groups()[1:] if v is not None][0]
+            for name in value.split():
+                usage.add(kind, name)
+    return usage
+
+def template_dirs():
+    dirs = list(getattr(settings, 'TEMPLATE_DIRS', ()))
+    for app in settings.INSTALLED_APPS:
+        try:
+            module = __import__(app, {}, {}, [''])
+        except ImportError:
+            continue
+        path = os.path.join(os.path.dirname(module.__file__), 'templates')
+        if os.path.isdir(path):
+            dirs.append(path)
+    return dirs
+
+def find_template(name, dirs=None):
+    for path in dirs or template_dirs():
+        filename = os.path.join(path, *name.split('/'))
+        if os.path.isfile(filename):
+            return filename
+    return None
+
+def scan_templates(dirs=None, safelist=None):
+    ''' Usage of every template below dirs, plus the safelist (settings.MEDIA_BUILD_SAFELIST) '''
+    if safelist is None:
+        safelist = getattr(settings, 'MEDIA_BUILD_SAFELIST', ())
+    usage = Usage(safelist)
+    for path in dirs or template_dirs():
+        for dirpath, dirnames, filenames in os.walk(path):
+            for filename in filenames:
+                if os.path.splitext(filename)[1] in TEMPLATE_EXTENSIONS:
+                    scan_markup(open(os.path.join(dirpath, filename)).read(), usage)
+    return usage
+
+def parse_blocks(source):
+    ''' {block name: content} of every {% block %} in source, nested ones included '''
+    blocks = {}
+    stack = []
+    for match in BLOCK_TAG.finditer(source):
+        if match.group(1):
+            stack.append((match.group(1), match.end()))
+        elif stack:
+            name, start = stack.pop()
+            blocks[name] = source[start:match.start()]
+    return blocks
+
+def split_blocks(source):
+    ''' source as a list of text and (block name, content) for its outermost {% block %}s '''
+    parts = []
+    pos = 0
+    stack = []
+    for match in BLOCK_TAG.finditer(source):
+        if match.group(1):
+            if not stack:
+                parts.append(source[pos:match.start()])
+            stack.append((match.group(1), match.end()))
+        elif stack:
+            name, start = stack.pop()
+            if not stack:
+                parts.append((name, source[start:match.start()]))
+                pos = match.end()
+    parts.append(source[pos:])
+    return parts
+
+def block(name, content):
+    return '{%% block %s %%}%s{%% endblock %%}' % (name, content)
+
+def with_super(source, name, parent_blocks):
+    ''' source with {{ block.super }} replaced by the content of the parent's block of the same name '''
+    out = []
+    for part in split_blocks(source):
+        if isinstance(part, tuple):
+            out.append(block(part[0], with_super(part[1], part[0], parent_blocks)))
+        else:
+            out.append(BLOCK_SUPER.sub(lambda m: parent_blocks.get(name, ''), part))
+    return ''.join(out)
+
+def fill_blocks(source, blocks, parent_blocks):
+    ''' source with its blocks replaced by the ones in blocks, as {% extends %} does '''
+    out = []
+    for part in split_blocks(source):
+        if not isinstance(part, tuple):
+            out.append(part)
+        elif part[0] in blocks:
+            out.append(block(part[0], with_super(blocks[part[0]], part[0], parent_blocks)))
+        else:
+            out.append(block(part[0], fill_blocks(part[1], blocks, parent_blocks)))
+    return ''.join(out)
+
+def compose(name, dirs=None, depth=0):
+    ''' The source of a template with the templates it extends filled in, None if it isn't found '''
+    filename = find_template(name, dirs)
+    if filename is None:
+        logging.warning('mediabuild: template %s not found' % name)
+        return None
+    source = open(filename).read()
+    match = EXTENDS.search(TEMPLATE_COMMENT.sub(' ', source))
+    if match is None or depth >= MAX_INCLUDE_DEPTH:
+        return source
+    parent = compose(match.group(1), dirs, depth + 1)
+    if parent is None:
+        return source
+    # what a child has outside its blocks isn't rendered
+    return fill_blocks(parent, parse_blocks(source), parse_blocks(parent))
+
+def scan_layout(name, dirs=None, safelist=None, usage=None, depth=0):
+    '''
+    Usage of a layout above its fold marker: the templates it extends are filled in with its
+    blocks, and the templates it includes there are followed
+    '''
+    if usage is None:
+        if safelist is None:
+            safelist = getattr(settings, 'MEDIA_BUILD_SAFELIST', ())
+        usage = Usage(safelist)
+    source = compose(name, dirs)
+    if source is None:
+        return usage
+    source = source.split(FOLD_MARKER)[0]
+    scan_markup(source, usage)
+    if depth < MAX_INCLUDE_DEPTH:
+        for included in INCLUDE.findall(TEMPLATE_COMMENT.sub(' ', source)):
+            scan_layout(included, dirs, usage=usage, depth=depth + 1)
+    return usage
+
+# ---- stylesheets
+
+CSS_TOKENS = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|(/\*.*?\*/)''', re.S)
+CSS_PLACEHOLDER = re.compile(r'\x00(\d+)\x00')
+BLOCK_TOKEN = re.compile(r'[{};]')
+NESTED_AT_RULES = ('@media', '@supports', '@document')
+
+SELECTOR_IGNORED = re.compile(r'\[[^\]]*\]|::?[-\w]+(?:\([^)]*\))?')
+SELECTOR_CLASS = re.compile(r'\.(-?[_a-zA-Z][-\w]*)')
+SELECTOR_ID = re.compile(r'#(-?[_a-zA-Z][-\w]*)')
+SELECTOR_ELEMENT = re.compile(r'(?:^|[\s>+~])([a-zA-Z][-\w]*)')
+
+def protect_strings(css):
+    ''' Comments removed, strings replaced by placeholders; returns (css, strings) '''
+    strings = []
+    def replace(match):
+        if match.group(2) is not None:
+            return ' '
+        strings.append(match.group(1))
+        return '\x00%d\x00' % (len(strings) - 1)
+    return CSS_TOKENS.sub(replace, css), strings
+
+def restore_strings(css, strings):
+    return CSS_PLACEHOLDER.sub(lambda m: strings[int(m.group(1))], css)
+
+def matching_brace(css, pos):
+    ''' Position after the } closing the block that starts at pos '''
+    depth = 1
+    while depth:
+        m = BLOCK_TOKEN.search(css, pos)
+        if m is None:
+            return len(css)
+        pos = m.end()
+        if m.group() == '{':
+            depth += 1
+        elif m.group() == '}':
+            depth -= 1
+    return pos
+
+def parse(css, pos=0):
+    '''
+    [(prelude, body), ...]: body is the declarations of a rule, a list of rules for @media
+    and the like, the raw block of other at-rules (@font-face, @keyframes) and None for
+    statements (@import, @charset). Returns (rules, position after the block).
+    '''
+    rules = []
+    while pos < len(css):
+        m = BLOCK_TOKEN.search(css, pos)
+        if m is None:
+            break
+        prelude = css[pos:m.start()].strip()
+        token = m.group()
+        if token == '}':
+            return rules, m.end()
+        if token == ';':
+            if prelude:
+                rules.append((prelude, None))
+            pos = m.end()
+        elif prelude.lower().startswith(NESTED_AT_RULES):
+            body, pos = parse(css, m.end())
+            rules.append((prelude, body))
+        elif prelude.startswith('@'):
+            end = matching_brace(css, m.end())
+            rules.append((prelude, '{' + css[m.end():end]))
+            pos = end
+        else:
+            end = css.find('}', m.end())
+            if end < 0:
+                end = len(css)
+            rules.append((prelude, css[m.end():end].strip()))
+            pos = end + 1
+    return rules, pos
+
+def serialize(rules):
+    out = []
+    for prelude, body in rules:
+        if body is None:
+            out.append(prelude + ';')
+        elif isinstance(body, list):
+            out.append('%s {\n%s}' % (prelude, serialize(body)))
+        elif prelude.startswith('@'):
+            out.append(prelude + ' ' + body)
+        else:
+            out.append('%s {%s}' % (prelude, body))
+    return '\n'.join(out) + '\n'
+
+def split_selectors(prelude):
+    selectors = []
+    depth = 0
+    start = 0
+    for i, c in enumerate(prelude):
+        if c in '([':
+            depth += 1
+        elif c in ')]':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            selectors.append(prelude[start:i].strip())
+            start = i + 1
+    selectors.append(prelude[start:].strip())
+    return [s for s in selectors if s]
+
+def selector_used(selector, usage):
+    selector = SELECTOR_IGNORED.sub('', selector)
+    for name in SELECTOR_CLASS.findall(selector):
+        if not usage.uses('.', name):
+            return False
+    for name in SELECTOR_ID.findall(selector):
+        if not usage.uses('#', name):
+            return False
+    for name in SELECTOR_ELEMENT.findall(SELECTOR_ID.sub('', SELECTOR_CLASS.sub('', selector))):
+        if not usage.uses('', name):
+            return False
+    return True
+
+def prune_rules(rules, usage, keep_at_rules=True):
+    pruned = []
+    for prelude, body in rules:
+        if isinstance(body, list):
+            body = prune_rules(body, usage, keep_at_rules)
+            if body:
+                pruned.append((prelude, body))
+        elif prelude.startswith('@'):
+            if keep_at_rules:
+                pruned.append((prelude, body))
+        else:
+            selectors = [s for s in split_selectors(prelude) if selector_used(s, usage)]
+            if selectors:
+                pruned.append((', '.join(selectors), body))
+    return pruned
+
+def prune_css(css, usage):
+    ''' css without the rules usage doesn't need '''
+    css, strings = protect_strings(css)
+    rules = prune_rules(parse(css)[0], usage)
+    return restore_strings(serialize(rules), strings)
+
+def critical_css(css, usage, max_size=CRITICAL_MAX, name='critical CSS'):
+    '''
+    The rules of css usage needs, in order, for the screen, at most max_size bytes: a rule that
+    doesn't fit anymore is left out and the next ones are tried. Leaves out at-rules other than
+    @media: imports and fonts are left to the full stylesheet.
+    '''
+    css, strings = protect_strings(css)
+    rules = []
+    for prelude, body in prune_rules(parse(css)[0], usage, keep_at_rules=False):
+        if isinstance(body, list) and 'print' in prelude.lower() and 'screen' not in prelude.lower():
+            continue
+        rules.append((prelude, body))
+    out = []
+    size = 0
+    skipped = 0
+    for rule in rules:
+        text = restore_strings(serialize([rule]), strings)
+        if size + len(text) > max_size:
+            skipped += 1
+            continue
+        out.append(text)
+        size += len(text)
+    if skipped:
+        logging.warning('mediabuild: %s: %d of %d rules left out to stay within %d bytes'
+                        % (name, skipped, len(rules), max_size))
+    return ''.join(out)
+
+def prune_paths():
+    return tuple(getattr(settings, 'MEDIA_BUILD_PRUNE', ()))
+
+def should_prune(path):
+    return path.endswith('.css') and path.startswith(prune_paths())
+
+def critical_bundles(languages=None):
+    ''' {critical bundle name: (bundle name, layout template)} with the language placeholders expanded '''
+    from mediabuild.build import expand
+    if languages is None:
+        languages = [code for code, name in settings.LANGUAGES]
+    bundles = {}
+    for name, (bundle, layout) in getattr(settings, 'MEDIA_BUILD_CRITICAL', {}).items():
+        for code in languages:
+            bundles[expand(name, code)] = (expand(bundle, code), expand(layout, code))
+    return bundles
+
+def main(argv):
+    from mediabuild import build
+    usage = scan_templates()
+    for name, paths in sorted(build.get_bundles().items()):
+        for path, url, content in build.read_inputs(name, paths):
+            if path.endswith('.css'):
+                pruned = prune_css(content, usage)
+                print '%-40s %-40s %7d -> %7d bytes%s' % (name, path, len(content), len(pruned),
+                                                        not should_prune(path) and '  (not in MEDIA_BUILD_PRUNE)' or '')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,85 @@
+'''
+    {% load assets %}
+    <link rel="stylesheet" href="{% asset "combined-%(LANGUAGE_DIR)s.css" %}">
+    <script src="{% asset "combined-%(LANGUAGE_CODE)s.js" %}"></script>
+
+The URL of a bundle's current fingerprinted file from the manifest of
+mediabuild.build, with the placeholders filled in for the active
+language. Bundles that aren't in the manifest (nothing built yet) fall back
+to MEDIA_URL/<name>, where ragendja serves its own combined files.
+
+    <style>{% inline_asset "critical-%(LANGUAGE_DIR)s.css" %}</style>
+    {% async_stylesheet "combined-%(LANGUAGE_DIR)s.css" %}
+
+inline_asset outputs the content of a built bundle (typically critical CSS,
+see mediabuild.prune), nothing if it isn't built. async_stylesheet links a
+stylesheet so that it doesn't hold up rendering: it's requested for print
+and switched to all media once loaded, with a <noscript> fallback.
+
+The manifest is read once per process; with DEBUG on it's re-read
+whenever it changes. Inlined contents are kept per file name.
+'''
+
+import os
+
+from django import template
+from django.conf import settings
+from django.utils import translation
+from django.utils.safestring import mark_safe
+
+from mediabuild import build
+
+register = template.Library()
+
+_manifest = {'mtime': None, 'bundles': None}
+_contents = {}
+
+ASYNC_STYLESHEET = ('<link rel="stylesheet" href="%(url)s" media="print" onload="this.media=\'all\'">'
+                    '<noscript><link rel="stylesheet" href="%(url)s"></noscript>')
+
+def get_manifest():
+    if _manifest['bundles'] is None or settings.DEBUG:
+        path = os.path.join(build.build_root(), build.MANIFEST)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        if mtime != _manifest['mtime'] or _manifest['bundles'] is None:
+            _manifest['bundles'] = build.load_manifest(build.build_root())
+            _manifest['mtime'] = mtime
+    return _manifest['bundles']
+
+def find(name):
+    ''' The manifest entry of a bundle for the active language, None if it isn't built '''
+    code = translation.get_language() or settings.LANGUAGE_CODE
+    bundles = get_manifest()
+    # 'en-us' uses the 'en' bundle unless it has its own
+    for candidate in (build.expand(name, code), build.expand(name, code.split('-')[0])):
+        if candidate in bundles:
+            return bundles[candidate]
+    return None
+
+def asset(name):
+    entry = find(name)
+    if entry is None:
+        return settings.MEDIA_URL + build.expand(name, translation.get_language() or settings.LANGUAGE_CODE)
+    return build.build_url() + entry['file']
+
+def inline_asset(name):
+    entry = find(name)
+    if entry is None:
+        return ''
+    filename = entry['file']
+    if filename not in _contents:
+        try:
+            _contents[filename] = open(os.path.join(build.build_root(), filename), 'rb').read().decode('utf-8')
+        except IOError:
+            return ''
+    return mark_safe(_contents[filename])
+
+def async_stylesheet(name):
+    return mark_safe(ASYNC_STYLESHEET % {'url': asset(name)})
+
+register.simple_tag(asset)
+register.simple_tag(inline_asset)
+register.simple_tag(async_stylesheet)
@@ -0,0 +1,133 @@
+'''
+Row counts for makeobjectlist's offset pagination.
+
+    exact        COUNT(*) on every render (Django's Paginator)
+    cached       COUNT(*) once per COUNT_TTL seconds for each query, the
+                 count is kept in Django's cache under the query's SQL
+    approximate  the database's own row estimate of the table (PostgreSQL
+                 pg_class.reltuples, MySQL information_schema) for unfiltered
+                 lists of at least APPROXIMATE_MIN rows; anything else falls
+                 back to the cached count. The paginator then says "about
+                 N pages" and doesn't link the last pages.
+'''
+
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator, Page, EmptyPage
+from django.db import connection
+
+COUNT_EXACT = 'exact'
+COUNT_CACHED = 'cached'
+COUNT_APPROXIMATE = 'approximate'
+COUNT_MODES = (COUNT_EXACT, COUNT_CACHED, COUNT_APPROXIMATE)
+
+KEY_COUNT = 'OBJECTLIST_COUNT_'
+COUNT_TTL = 5 * 60
+# below this the estimate isn't worth it, and fresh table statistics are often 0
+APPROXIMATE_MIN = 10000
+
+ESTIMATE_SQL = {
+    'postgresql': 'SELECT reltuples FROM pg_class WHERE relname = %s',
+    'mysql': 'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s',
+}
+
+def vendor():
+    name = getattr(connection, 'vendor', None) or getattr(settings, 'DATABASE_ENGINE', '')
+    if name.startswith('postgresql'):
+        return 'postgresql'
+    return name
+
+def signature(queryset):
+    ''' Cache key of a queryset's count: its model and SQL, None if it has none (e.g. a list) '''
+    try:
+        sql = str(queryset.query)
+    except Exception:
+        return None
+    model = queryset.model._meta
+    return KEY_COUNT + hashlib.md5('%s.%s|%s' % (model.app_label, model.object_name, sql)).hexdigest()
+
+def exact_count(object_list):
+    try:
+        return object_list.count()
+    except (AttributeError, TypeError):
+        # a list
+        return len(object_list)
+
+def cached_count(object_list, ttl=COUNT_TTL):
+    key = signature(object_list)
+    if key is None:
+        return exact_count(object_list)
+    count = cache.get(key)
+    if count is None:
+        count = exact_count(object_list)
+        cache.set(key, count, ttl)
+    return count
+
+def table_estimate(queryset):
+    ''' The database's row estimate of an unfiltered queryset's table, None if there is none '''
+    sql = ESTIMATE_SQL.get(vendor())
+    query = getattr(queryset, 'query', None)
+    if sql is None or query is None or query.where.children or getattr(query, 'distinct', False):
+        return None
+    try:
+        cursor = connection.cursor()
+        cursor.execute(sql, [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    except Exception, e:
+        logging.warning('objectlist: no row estimate for %s: %s' % (queryset.model._meta.db_table, e))
+        return None
+    return row and row[0] is not None and int(row[0]) or None
+
+def approximate_count(object_list, ttl=COUNT_TTL):
+    ''' Returns (count, approximate) '''
+    key = signature(object_list)
+    if key is not None:
+        estimate = cache.get(key + '_APPROX')
+        if estimate is None:
+            estimate = table_estimate(object_list) or 0
+            cache.set(key + '_APPROX', estimate, ttl)
+        if estimate >= APPROXIMATE_MIN:
+            return estimate, True
+    return cached_count(object_list, ttl), False
+
+class CountedPaginator(Paginator):
+    '''
+    A Paginator with a count given up front. With approximate=True the count is an estimate:
+    pages past the estimated end are served while they have rows, and pages aren't shortened
+    to the estimated end.
+    '''
+    def __init__(self, object_list, per_page, count, approximate=False, **kwargs):
+        Paginator.__init__(self, object_list, per_page, **kwargs)
+        self._count = count
+        self.approximate = approximate
+
+    def validate_number(self, number):
+        if not self.approximate:
+            return Paginator.validate_number(self, number)
+        number = int(number)
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    def page(self, number):
+        if not self.approximate:
+            return Paginator.page(self, number)
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        object_list = self.object_list[bottom:bottom + self.per_page]
+        if number > 1 and number > self.num_pages:
+            object_list = list(object_list)
+            if not object_list:
+                raise EmptyPage('That page contains no results')
+        return Page(object_list, number, self)
+
+def make_paginator(object_list, per_page, mode=COUNT_EXACT, ttl=COUNT_TTL):
+    if mode == COUNT_CACHED:
+        return CountedPaginator(object_list, per_page, cached_count(object_list, ttl), allow_empty_first_page=True)
+    if mode == COUNT_APPROXIMATE:
+        count, approximate = approximate_count(object_list, ttl)
+        return CountedPaginator(object_list, per_page, count, approximate, allow_empty_first_page=True)
+    return Paginator(object_list, per_page, allow_empty_first_page=True)
@@ -0,0 +1,139 @@
+'''
+Keyset (cursor) pagination.
+
+Pages are addressed by the key of the last row of the previous page
+(?after=<key>) or of the first row of the next page (?before=<key>) instead
+of an offset, and each page is fetched with WHERE key > ... LIMIT per_page+1;
+the extra row tells whether there is a next page. No COUNT(*) is needed and
+no rows are read just to be skipped over by an OFFSET, so a page deep into a
+large table costs the same as the first one.
+
+The order_by field should be unique (e.g. the primary key, or a timestamp
+that can't repeat), otherwise rows sharing a key at a page boundary are
+skipped. Page numbers are carried along in ?page= for display only; the
+pages around the current one are found by reading the keys of the next and
+previous `lookahead` pages.
+'''
+
+import urllib
+
+LOOKAHEAD = 4
+
+def quote(value):
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return urllib.quote(str(value))
+
+class KeysetPage(object):
+    def __init__(self, object_list, number, has_next, has_previous, next_pages, previous_pages):
+        self.object_list = object_list
+        self.number = number
+        self._has_next = has_next
+        self._has_previous = has_previous
+        # [{'number': n, 'query': 'after=...&page=n'}, ...], nearest page first
+        self.next_pages = next_pages
+        self.previous_pages = previous_pages
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+    def next_query(self):
+        return self.next_pages and self.next_pages[0]['query'] or ''
+
+    def previous_query(self):
+        return self.previous_pages and self.previous_pages[0]['query'] or ''
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __repr__(self):
+        return '<Keyset page %s>' % self.number
+
+class KeysetPaginator(object):
+    def __init__(self, queryset, per_page, order_by, lookahead=LOOKAHEAD):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.order_by = order_by
+        self.field = order_by.lstrip('-')
+        self.descending = order_by.startswith('-')
+        self.lookahead = lookahead
+
+    def forward(self):
+        return self.queryset.order_by(self.order_by)
+
+    def backward(self):
+        return self.queryset.order_by(self.descending and self.field or '-' + self.field)
+
+    def after(self, queryset, key):
+        return queryset.filter(**{'%s__%s' % (self.field, self.descending and 'lt' or 'gt'): key})
+
+    def before(self, queryset, key):
+        return queryset.filter(**{'%s__%s' % (self.field, self.descending and 'gt' or 'lt'): key})
+
+    def key(self, object):
+        return getattr(object, self.field)
+
+    def page(self, after=None, before=None, number=1):
+        per_page = self.per_page
+        if before is not None:
+            rows = list(self.before(self.backward(), before)[:per_page + 1])
+            has_previous = len(rows) > per_page
+            rows = rows[:per_page]
+            rows.reverse()
+            has_next = True
+        else:
+            queryset = self.forward()
+            if after is not None:
+                queryset = self.after(queryset, after)
+            rows = list(queryset[:per_page + 1])
+            has_next = len(rows) > per_page
+            rows = rows[:per_page]
+            has_previous = after is not None
+
+        if not rows:
+            return KeysetPage(rows, 1, False, False, [], [])
+
+        if not has_previous:
+            number = 1
+        elif number < 2:
+            number = 2
+        next_pages = []
+        if has_next:
+            next_pages = self.nearby_pages(self.after(self.forward(), self.key(rows[-1])), number, 1, 'after', self.key(rows[-1]))
+        previous_pages = []
+        if has_previous:
+            previous_pages = self.nearby_pages(self.before(self.backward(), self.key(rows[0])), number, -1, 'before', self.key(rows[0]))
+        return KeysetPage(rows, number, has_next, has_previous, next_pages, previous_pages)
+
+    def nearby_pages(self, queryset, number, step, direction, key):
+        '''
+        Links to the next (step=1) or previous (step=-1) lookahead pages, queryset holds the rows
+        past the current page in that direction; only their keys are read.
+        '''
+        keys = []
+        if self.lookahead > 1:
+            keys = list(queryset.values_list(self.field, flat=True)[:self.per_page * (self.lookahead - 1) + 1])
+        pages = []
+        for i in range(self.lookahead):
+            n = number + step * (i + 1)
+            if n == 1:
+                pages.append({'number': 1, 'query': 'page=1'})
+                break
+            if n < 1 or (i and len(keys) <= i * self.per_page):
+                break
+            if i:
+                key = keys[i * self.per_page - 1]
+            pages.append({'number': n, 'query': '%s=%s&page=%d' % (direction, quote(key), n)})
+        return pages
@@ -5,25 +5,75 @@ makeobjectlist tag
 
 '''
 
+import ast
 import logging
 from django import template
 from django.template.loader import render_to_string
 from django.utils.safestring import mark_safe
 from django.core.paginator  import Paginator, InvalidPage
 from rendertag.templatetags.parseargshelper import parse_args_kwargs_and_as_var
+from objectlisttag.keyset import KeysetPaginator
+from objectlisttag.counts import make_paginator, COUNT_EXACT, COUNT_MODES, COUNT_TTL
 
 register = template.Library()
 
+MODE_OFFSET = 'offset'
+MODE_KEYSET = 'keyset'
+
+PAGINATE_BY = 10
+
+def compile_filter(expression):
+    '''
+    Compile an addtion_filter such as "comments.all" or "filter(published=True).order_by('-date')"
+    into a list of (name, (args, kwargs) or None) steps. Only attribute access and calls with
+    literal arguments are allowed, and no names starting with an underscore.
+    '''
+    try:
+        node = ast.parse('object.' + expression, mode='eval').body
+    except SyntaxError:
+        raise template.TemplateSyntaxError, "addtion_filter %r is not a valid expression" % expression
+    steps = []
+    while not isinstance(node, ast.Name):
+        call = None
+        if isinstance(node, ast.Call):
+            if node.starargs or node.kwargs or not isinstance(node.func, ast.Attribute):
+                raise template.TemplateSyntaxError, "addtion_filter %r: only method calls are allowed" % expression
+            try:
+                call = ([ast.literal_eval(a) for a in node.args],
+                        dict((str(k.arg), ast.literal_eval(k.value)) for k in node.keywords))
+            except ValueError:
+                raise template.TemplateSyntaxError, "addtion_filter %r: arguments must be literals" % expression
+            node = node.func
+        if not isinstance(node, ast.Attribute) or node.attr.startswith('_'):
+            raise template.TemplateSyntaxError, "addtion_filter %r: only attributes and method calls are allowed" % expression
+        steps.append((node.attr, call))
+        node = node.value
+    steps.reverse()
+    return steps
+
+def apply_filter(object, steps):
+    for name, call in steps:
+        object = getattr(object, name)
+        if call is not None:
+            args, kwargs = call
+            object = object(*args, **kwargs)
+        elif callable(object) and not hasattr(object, 'model'):
+            # like in template variables, "comments.all" calls all()
+            object = object()
+    return object
+
 class MakeObjectListNode(template.Node):
-    def __init__(self, object_ref, as_var, paginate_by, addtion_filter):
+    def __init__(self, object_ref, as_var, paginate_by, addtion_filter, mode=MODE_OFFSET, order_by=None,
+                 count=COUNT_EXACT, count_ttl=COUNT_TTL):
         self.object_ref = template.Variable(object_ref)
         self.as_var = as_var
-        try: 
-            self.paginate_by = int(paginate_by)
-        except: 
-            self.paginate_by = 10
-            
+        self.paginate_by = paginate_by
         self.addtion_filter = addtion_filter
+        self.filter_steps = addtion_filter is not None and compile_filter(addtion_filter) or []
+        self.mode = mode
+        self.order_by = order_by
+        self.count = count
+        self.count_ttl = count_ttl
             
     def render(self, context):
         try: 
@@ -34,12 +84,15 @@ class MakeObjectListNode(template.Node):
         if self.as_var is None:
             self.as_var = 'object_list'
         
-        if self.addtion_filter is not None: 
-            queryset = eval("object." + self.addtion_filter)
+        if self.filter_steps: 
+            queryset = apply_filter(object, self.filter_steps)
         else:
             queryset = object
+
+        if self.mode == MODE_KEYSET:
+            return self.render_keyset(queryset, context)
             
-        paginator = Paginator(queryset, self.paginate_by,  allow_empty_first_page=True)
+        paginator = make_paginator(queryset, self.paginate_by, self.count, self.count_ttl)
         
         request = context['request']
         page = request.GET.get('page', 1)
@@ -63,6 +116,24 @@ class MakeObjectListNode(template.Node):
         context['page_obj'] = page_obj
 
         return ''
+
+    def render_keyset(self, queryset, context):
+        paginator = KeysetPaginator(queryset, self.paginate_by, self.order_by)
+
+        request = context['request']
+        try:
+            page_number = int(request.GET.get('page', 1))
+        except ValueError:
+            page_number = 1
+        page_obj = paginator.page(after=request.GET.get('after'),
+                                  before=request.GET.get('before'),
+                                  number=page_number)
+
+        context[self.as_var] = page_obj.object_list
+        context['paginator'] = paginator
+        context['page_obj'] = page_obj
+
+        return ''
         
     
 def do_make_object_list(parser, token):
@@ -71,10 +142,40 @@ def do_make_object_list(parser, token):
         raise template.TemplateSyntaxError, "%r requires at least 1 arguments" % bits[0]
     else: 
         args, kwargs, as_var = parse_args_kwargs_and_as_var(parser, bits[1:])
+        paginate_by = kwargs.get("paginate_by", str(PAGINATE_BY)).strip('"\'')
+        try:
+            paginate_by = int(paginate_by)
+        except ValueError:
+            raise template.TemplateSyntaxError, "%r: paginate_by must be a number, not %r" % (bits[0], paginate_by)
+        if paginate_by < 1:
+            raise template.TemplateSyntaxError, "%r: paginate_by must be at least 1" % bits[0]
+        addtion_filter = kwargs.get("addtion_filter")
+        if addtion_filter is not None:
+            addtion_filter = addtion_filter.strip('"\'')
+        count = kwargs.get("count", COUNT_EXACT).strip('"\'')
+        if count not in COUNT_MODES:
+            raise template.TemplateSyntaxError, "%r: count must be one of %s" % (bits[0], ', '.join(COUNT_MODES))
+        count_ttl = kwargs.get("count_ttl", str(COUNT_TTL)).strip('"\'')
+        try:
+            count_ttl = int(count_ttl)
+        except ValueError:
+            raise template.TemplateSyntaxError, "%r: count_ttl must be a number of seconds, not %r" % (bits[0], count_ttl)
+        mode = kwargs.get("mode", MODE_OFFSET).strip('"\'')
+        order_by = kwargs.get("order_by")
+        if mode not in (MODE_OFFSET, MODE_KEYSET):
+            raise template.TemplateSyntaxError, "%r: mode must be %s or %s" % (bits[0], MODE_OFFSET, MODE_KEYSET)
+        if mode == MODE_KEYSET:
+            if order_by is None:
+                raise template.TemplateSyntaxError, "%r: mode=keyset requires order_by" % bits[0]
+            order_by = order_by.strip('"\'')
         return MakeObjectListNode(args[0], 
-                                paginate_by = kwargs.get("paginate_by"),
-                                addtion_filter = kwargs.get("addtion_filter"),
-                                as_var = as_var)
+                                paginate_by = paginate_by,
+                                addtion_filter = addtion_filter,
+                                as_var = as_var,
+                                mode = mode,
+                                order_by = order_by,
+                                count = count,
+                                count_ttl = count_ttl)
 
 register.tag('makeobjectlist', do_make_object_list)
 
@@ -0,0 +1,17 @@
+'''
+Sends the prev/next/prefetch page links of a {% paginator hints=1 %} tag as an
+HTTP Link header too, so that browsers and caching proxies can fetch the
+next page before it's clicked:
+
+    MIDDLEWARE_CLASSES = (
+        'paginatortag.middleware.LinkHeaderMiddleware',
+        ...
+    )
+'''
+
+class LinkHeaderMiddleware(object):
+    def process_response(self, request, response):
+        links = getattr(request, 'paginator_links', None)
+        if links and not response.has_header('Link'):
+            response['Link'] = ', '.join(['<%s>; rel=%s' % (url, rel) for url, rel in links])
+        return response
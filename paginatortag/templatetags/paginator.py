@@ -5,6 +5,10 @@
 #  has been modified to use the "page_obj" and "paginator" only from context
 #
 from django import template
+from django.template.loader import get_template
+from django.utils.html import escape
+from rendertag.templatetags.parseargshelper import parse_args_kwargs_and_as_var
+from tieredcache import LRUCache
  
 register = template.Library()
  
@@ -12,8 +16,22 @@ LEADING_PAGE_RANGE_DISPLAYED = TRAILING_PAGE_RANGE_DISPLAYED = 10
 LEADING_PAGE_RANGE = TRAILING_PAGE_RANGE = 8
 NUM_PAGES_OUTSIDE_RANGE = 2 
 ADJACENT_PAGES = 4
+
+# the window constants, each can be overridden as a tag argument: {% paginator adjacent_pages=2 %}
+WINDOW = {
+    'leading_page_range_displayed': LEADING_PAGE_RANGE_DISPLAYED,
+    'trailing_page_range_displayed': TRAILING_PAGE_RANGE_DISPLAYED,
+    'leading_page_range': LEADING_PAGE_RANGE,
+    'trailing_page_range': TRAILING_PAGE_RANGE,
+    'num_pages_outside_range': NUM_PAGES_OUTSIDE_RANGE,
+    'adjacent_pages': ADJACENT_PAGES,
+}
+
+# rendered navigation, keyed by everything it depends on
+NAV_CACHE_SIZE = 1000
+_navigation = LRUCache(NAV_CACHE_SIZE)
  
-def paginator(context):
+def paginator(context, window=WINDOW):
     page_obj = context["page_obj"]
     paginator = context["paginator"]
     if (page_obj.has_other_pages()):
@@ -22,22 +40,23 @@ def paginator(context):
         pages =  paginator.num_pages
         in_leading_range = in_trailing_range = False
         pages_outside_leading_range = pages_outside_trailing_range = range(0)
+        outside = window['num_pages_outside_range']
  
-        if (pages <= LEADING_PAGE_RANGE_DISPLAYED):
+        if (pages <= window['leading_page_range_displayed']):
             in_leading_range = in_trailing_range = True
-            page_numbers = [n for n in range(1, pages + 1) if n > 0 and n <= pages]           
-        elif (page <= LEADING_PAGE_RANGE):
+            page_numbers = range(1, pages + 1)
+        elif (page <= window['leading_page_range']):
             in_leading_range = True
-            page_numbers = [n for n in range(1, LEADING_PAGE_RANGE_DISPLAYED + 1) if n > 0 and n <= pages]
-            pages_outside_leading_range = [n + pages for n in range(0, -NUM_PAGES_OUTSIDE_RANGE, -1)]
-        elif (page > pages - TRAILING_PAGE_RANGE):
+            page_numbers = range(1, min(window['leading_page_range_displayed'], pages) + 1)
+            pages_outside_leading_range = range(pages, pages - outside, -1)
+        elif (page > pages - window['trailing_page_range']):
             in_trailing_range = True
-            page_numbers = [n for n in range(pages - TRAILING_PAGE_RANGE_DISPLAYED + 1, pages + 1) if n > 0 and n <= pages]
-            pages_outside_trailing_range = [n + 1 for n in range(0, NUM_PAGES_OUTSIDE_RANGE)]
+            page_numbers = range(max(pages - window['trailing_page_range_displayed'] + 1, 1), pages + 1)
+            pages_outside_trailing_range = range(1, outside + 1)
         else: 
-            page_numbers = [n for n in range(page - ADJACENT_PAGES, page + ADJACENT_PAGES + 1) if n > 0 and n <= pages]
-            pages_outside_leading_range = [n + pages for n in range(0, -NUM_PAGES_OUTSIDE_RANGE, -1)]
-            pages_outside_trailing_range = [n + 1 for n in range(0, NUM_PAGES_OUTSIDE_RANGE)]
+            page_numbers = range(max(page - window['adjacent_pages'], 1), min(page + window['adjacent_pages'], pages) + 1)
+            pages_outside_leading_range = range(pages, pages - outside, -1)
+            pages_outside_trailing_range = range(1, outside + 1)
         return {
             "is_paginated": page_obj.has_other_pages(),
             "previous": page_obj.previous_page_number(),
@@ -51,7 +70,108 @@ def paginator(context):
             "in_leading_range" : in_leading_range,
             "in_trailing_range" : in_trailing_range,
             "pages_outside_leading_range": pages_outside_leading_range,
-            "pages_outside_trailing_range": pages_outside_trailing_range
+            "pages_outside_trailing_range": pages_outside_trailing_range,
+            # the page count is an estimate (makeobjectlist count=approximate)
+            "approximate": getattr(paginator, 'approximate', False)
         }
- 
-register.inclusion_tag("paginator.html", takes_context=True)(paginator)
\ No newline at end of file
+    return {}
+
+def page_links(path, page_obj):
+    ''' [(url, rel), ...] of the pages next to page_obj, for {% paginatorlinks %} and the Link header '''
+    links = []
+    if page_obj.has_previous():
+        links.append(('%s?page=%d' % (path, page_obj.previous_page_number()), 'prev'))
+    if page_obj.has_next():
+        url = '%s?page=%d' % (path, page_obj.next_page_number())
+        links.append((url, 'next'))
+        links.append((url, 'prefetch'))
+    return links
+
+class PaginatorNode(template.Node):
+    def __init__(self, window=WINDOW, hints=False):
+        self.window = window
+        self.window_key = tuple(sorted(window.items()))
+        self.hints = hints
+
+    def render(self, context):
+        page_obj = context["page_obj"]
+        paginator_obj = context["paginator"]
+        request = context.get('request')
+        if self.hints and request is not None and page_obj.has_other_pages():
+            # picked up by paginatortag.middleware.LinkHeaderMiddleware
+            request.paginator_links = page_links(request.path, page_obj)
+
+        # the links are relative (?page=N), so the same navigation serves every path
+        key = (page_obj.number, paginator_obj.num_pages, paginator_obj.per_page,
+               getattr(paginator_obj, 'approximate', False), self.window_key)
+        output = _navigation.get(key)
+        if output is None:
+            dictionary = paginator(context, self.window)
+            output = get_template("paginator.html").render(template.Context(dictionary, autoescape=context.autoescape))
+            _navigation.set(key, output)
+        return output
+
+def do_paginator(parser, token):
+    bits = token.split_contents()
+    args, kwargs, as_var = parse_args_kwargs_and_as_var(parser, bits[1:])
+    window = dict(WINDOW)
+    hints = False
+    for name, value in kwargs.items():
+        value = value.strip('"\'')
+        if name == 'hints':
+            hints = value.lower() not in ('0', 'false', 'no', 'off')
+            continue
+        if name not in WINDOW:
+            raise template.TemplateSyntaxError, "%r: unknown argument %r" % (bits[0], name)
+        try:
+            window[name] = int(value)
+        except ValueError:
+            raise template.TemplateSyntaxError, "%r: %s must be a number" % (bits[0], name)
+        if window[name] < 1:
+            raise template.TemplateSyntaxError, "%r: %s must be at least 1" % (bits[0], name)
+    return PaginatorNode(window, hints)
+
+register.tag('paginator', do_paginator)
+
+class PaginatorLinksNode(template.Node):
+    def render(self, context):
+        page_obj = context.get('page_obj')
+        if page_obj is None or not page_obj.has_other_pages():
+            return ''
+        request = context.get('request')
+        links = page_links(request is not None and request.path or '', page_obj)
+        if request is not None:
+            request.paginator_links = links
+        return ''.join(['<link rel="%s" href="%s" />' % (rel, escape(url)) for url, rel in links])
+
+def do_paginatorlinks(parser, token):
+    """
+    The <link rel="prev/next/prefetch"> tags of the pages next to page_obj, for the <head>
+    of a page whose view puts page_obj in the context: {% block head %}{% paginatorlinks %}{% endblock %}
+    """
+    if len(token.split_contents()) != 1:
+        raise template.TemplateSyntaxError, "%r takes no arguments" % token.contents.split()[0]
+    return PaginatorLinksNode()
+
+register.tag('paginatorlinks', do_paginatorlinks)
+
+def keysetpaginator(context):
+    """
+    For keyset pages ({% makeobjectlist ... mode=keyset %}): prev/next and the nearby pages the
+    page knows about, no num_pages needed.
+    """
+    page_obj = context["page_obj"]
+    previous_pages = list(page_obj.previous_pages)
+    previous_pages.reverse()
+    return {
+        "is_paginated": page_obj.has_other_pages(),
+        "has_previous": page_obj.has_previous(),
+        "previous_query": page_obj.previous_query(),
+        "has_next": page_obj.has_next(),
+        "next_query": page_obj.next_query(),
+        "page": page_obj.number,
+        "previous_pages": previous_pages,
+        "next_pages": page_obj.next_pages,
+    }
+
+register.inclusion_tag("keyset_paginator.html", takes_context=True)(keysetpaginator)
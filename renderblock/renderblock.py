@@ -1,7 +1,10 @@
 # http://www.djangosnippets.org/snippets/942/
 from django.template.loader_tags import BlockNode, ExtendsNode
 from django.template import loader, Context, RequestContext, TextNode
-from django.http import HttpResponse
+from django.http import HttpResponse, Http404
+from django.utils import simplejson
+from django.utils.encoding import force_unicode
+from django.utils.safestring import mark_safe
 
 def get_template(template):
     if isinstance(template, (tuple, list)):
@@ -11,58 +14,183 @@ def get_template(template):
 class BlockNotFound(Exception):
     pass
 
+# template name -> {block name: ResolvedBlock}, for templates whose {% extends %} chain doesn't depend on the context
+_block_index = {}
+
+class ResolvedBlock(object):
+    """
+    A block as it renders after the {% extends %} overrides are applied: the nodelist of the most
+    derived template that defines it, parent is the block it overrides ({{ block.super }}).
+    """
+    def __init__(self, name, nodelist, parent=None):
+        self.name, self.nodelist, self.parent = name, nodelist, parent
+
+class BlockReference(object):
+    """ What {{ block }} resolves to inside a block rendered from the index """
+    def __init__(self, block, context, index):
+        self.block, self.context, self.index = block, context, index
+
+    def super(self):
+        if self.block.parent is None:
+            return ''
+        return mark_safe(''.join(iter_block(self.block.parent, self.context, self.index)))
+
+def static_parent(node):
+    """ True if the parent of an ExtendsNode is a literal template name, not a variable """
+    if getattr(node, 'parent_name_expr', None) is not None:
+        return False
+    name = getattr(node, 'parent_name', None)
+    if isinstance(name, basestring):
+        return True
+    # a FilterExpression: constants are kept as the string itself or as a literal Variable
+    var = getattr(name, 'var', None)
+    return isinstance(var, basestring) or isinstance(getattr(var, 'literal', None), basestring)
+
+def build_block_index(nodelist, context):
+    """
+    Returns ({block name: ResolvedBlock}, cacheable) for a template's nodelist, following its
+    {% extends %} chain once. cacheable is False if a parent template is chosen by a variable.
+    """
+    index = {}
+    cacheable = True
+    for node in nodelist:
+        if isinstance(node, ExtendsNode):
+            index, cacheable = build_block_index(node.get_parent(context).nodelist, context)
+            cacheable = cacheable and static_parent(node)
+            break
+    for node in nodelist.get_nodes_by_type(BlockNode):
+        index[node.name] = ResolvedBlock(node.name, node.nodelist, index.get(node.name))
+    return index, cacheable
+
+def get_block_index(template_name, context):
+    key = isinstance(template_name, (tuple, list)) and tuple(template_name) or template_name
+    index = _block_index.get(key)
+    if index is None:
+        index, cacheable = build_block_index(get_template(template_name).nodelist, context)
+        if cacheable:
+            _block_index[key] = index
+    return index
+
+def clear_block_index():
+    _block_index.clear()
+
+def iter_nodelist(nodelist, context, index):
+    """
+    Renders a nodelist node by node. A nested block is replaced by its override from the index,
+    nodes that can stream their output (they have an iter_render() method, like {% render %})
+    are streamed.
+    """
+    for node in nodelist:
+        if isinstance(node, BlockNode):
+            for bit in iter_block(index.get(node.name, node), context, index):
+                yield bit
+        elif hasattr(node, 'iter_render'):
+            for bit in node.iter_render(context):
+                yield force_unicode(bit)
+        else:
+            yield force_unicode(nodelist.render_node(node, context))
+
+def iter_block(block, context, index):
+    context.push()
+    try:
+        context['block'] = BlockReference(block, context, index)
+        for bit in iter_nodelist(block.nodelist, context, index):
+            yield bit
+    finally:
+        context.pop()
+
+def iter_indexed_block(index, block, context):
+    if block not in index:
+        raise BlockNotFound
+    return iter_block(index[block], context, index)
+
 def render_template_block(template, block, context):
     """
-    Renders a single block from a template. This template should have previously been rendered.
+    Renders a single block from a template.
     """
     return render_template_block_nodelist(template.nodelist, block, context)
     
 def render_template_block_nodelist(nodelist, block, context):
-    for node in nodelist:
-        if isinstance(node, BlockNode) and node.name == block:
-            return node.render(context)
-        for key in ('nodelist', 'nodelist_true', 'nodelist_false'):
-            if hasattr(node, key):
-                try:
-                    return render_template_block_nodelist(getattr(node, key), block, context)
-                except:
-                    pass
-    for node in nodelist:
-        if isinstance(node, ExtendsNode):
-            try:
-                return render_template_block(node.get_parent(context), block, context)
-            except BlockNotFound:
-                pass
-    raise BlockNotFound
+    index, cacheable = build_block_index(nodelist, context)
+    return ''.join(iter_indexed_block(index, block, context))
+
+def get_context(dictionary, context_instance):
+    dictionary = dictionary or {}
+    if context_instance:
+        context_instance.update(dictionary)
+        return context_instance
+    return Context(dictionary)
+
+def render_block_to_iterator(template_name, block, dictionary=None, context_instance=None):
+    """
+    Like render_block_to_string, but the block is rendered lazily and returned as an iterator of
+    strings: hand it to an HttpResponse to stream a large block (a long {% render %} list) to the
+    client while it's being rendered.
+    """
+    context_instance = get_context(dictionary, context_instance)
+    return iter_indexed_block(get_block_index(template_name, context_instance), block, context_instance)
 
 def render_block_to_string(template_name, block, dictionary=None, context_instance=None):
     """
     Loads the given template_name and renders the given block with the given dictionary as
-    context. Returns a string.
+    context. Returns a string. Only the block is rendered, looked up in an index of the
+    template's blocks (with the {% extends %} overrides applied) that is built once per template name.
     """
-    dictionary = dictionary or {}
-    t = get_template(template_name)
-    if context_instance:
-        context_instance.update(dictionary)
-    else:
-        context_instance = Context(dictionary)
-    t.render(context_instance)
-    return render_template_block(t, block, context_instance)
+    return ''.join(render_block_to_iterator(template_name, block, dictionary, context_instance))
 
-def direct_block_to_template(request, template, block, extra_context=None, mimetype=None, **kwargs):
+def render_blocks_to_dict(template_name, blocks, dictionary=None, context_instance=None):
     """
-    Render a given block in a given template with any extra URL parameters in the context as
-    ``{{ params }}``.
+    Renders several blocks of the given template with one context and one block index, returns
+    {block name: rendered block}. Raises BlockNotFound naming the first block that doesn't exist.
+    """
+    context_instance = get_context(dictionary, context_instance)
+    index = get_block_index(template_name, context_instance)
+    for block in blocks:
+        if block not in index:
+            raise BlockNotFound(block)
+    return dict((block, ''.join(iter_indexed_block(index, block, context_instance))) for block in blocks)
+
+def get_request_context(request, extra_context, params):
+    """
+    The RequestContext of the view helpers: extra_context (callables are called) and the extra URL
+    parameters as ``{{ params }}``.
     """
     if extra_context is None:
-    	extra_context = {}
-    dictionary = {'params': kwargs}
+        extra_context = {}
+    dictionary = {'params': params}
     for key, value in extra_context.items():
         if callable(value):
             dictionary[key] = value()
         else:
             dictionary[key] = value
-    c = RequestContext(request, dictionary)
-    t = get_template(template)
-    t.render(c)
-    return HttpResponse(render_template_block(t, block, c), mimetype=mimetype)
+    return RequestContext(request, dictionary)
+
+def direct_block_to_template(request, template, block, extra_context=None, mimetype=None, **kwargs):
+    """
+    Render a given block in a given template with any extra URL parameters in the context as
+    ``{{ params }}``.
+    """
+    c = get_request_context(request, extra_context, kwargs)
+    return HttpResponse(render_block_to_string(template, block, context_instance=c), mimetype=mimetype)
+
+def stream_block_to_template(request, template, block, extra_context=None, mimetype=None, **kwargs):
+    """
+    Same as direct_block_to_template, but the block is streamed to the client.
+    """
+    c = get_request_context(request, extra_context, kwargs)
+    return HttpResponse(render_block_to_iterator(template, block, context_instance=c), mimetype=mimetype)
+
+def direct_blocks_to_json(request, template, blocks=None, extra_context=None, **kwargs):
+    """
+    Render several blocks of a template at once and respond with a JSON object mapping block names
+    to their HTML. The blocks are given by the blocks argument or as ?blocks=name,name in the query
+    string; the context is built once for all of them. Unknown blocks are a 404.
+    """
+    if blocks is None:
+        blocks = [b for b in request.GET.get('blocks', '').split(',') if b]
+    c = get_request_context(request, extra_context, kwargs)
+    try:
+        result = render_blocks_to_dict(template, blocks, context_instance=c)
+    except BlockNotFound, e:
+        raise Http404('block %s not found' % e)
+    return HttpResponse(simplejson.dumps(result), mimetype='application/json')
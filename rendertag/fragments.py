@@ -0,0 +1,97 @@
+'''
+Fragment cache for the {% render %} tag.
+
+    {% render article cache=600 %}
+    {% render article_list cache=600 cachekey=updated %}
+
+A rendered fragment is stored under a key built from the template path, the
+object's class and primary key and a version:
+
+  - with cachekey=<field>, the value of that field (e.g. a last modified
+    timestamp or a version counter), so saving the object changes the key
+  - without it, a generation number kept in the cache, bumped by
+    invalidate(object); connect(Model, ...) does that on every save/delete
+
+Lists are looked up with one get_many (two without cachekey, the generations
+are fetched in bulk first), only the misses are rendered. Objects without a
+primary key are never cached. Uses Django's cache framework.
+'''
+
+import hashlib
+from time import time as now
+
+from django.core.cache import cache
+from django.db.models import signals
+
+KEY_RENDER = 'RENDER_'
+# generations have to outlive every fragment that uses them
+GENERATION_TIMEOUT = 30 * 24 * 60 * 60
+
+stats = {'hits': 0, 'misses': 0}
+
+def get_stats():
+    result = dict(stats)
+    lookups = result['hits'] + result['misses']
+    result['hit_rate'] = lookups and float(result['hits']) / lookups or 0.0
+    return result
+
+def object_id(object):
+    return getattr(object, 'pk', None)
+
+def generation_key(object):
+    return '%sGEN_%s_%s' % (KEY_RENDER, object.__class__.__name__, object_id(object))
+
+def make_key(templatepath, object, version):
+    key = '%s|%s|%s|%s' % (templatepath, object.__class__.__name__, object_id(object), version)
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    # hashed: template paths and versions may contain characters memcached doesn't accept
+    return KEY_RENDER + hashlib.md5(key).hexdigest()
+
+def make_keys(items, cachekey=None):
+    '''
+    items: list of (templatepath, object), returns a list of cache keys,
+    None for objects that can't be cached
+    '''
+    versions = {}
+    if cachekey is None:
+        genkeys = [generation_key(o) for p, o in items if object_id(o) is not None]
+        versions = cache.get_many(genkeys)
+
+    keys = []
+    for templatepath, object in items:
+        if object_id(object) is None:
+            keys.append(None)
+            continue
+        if cachekey is not None:
+            version = getattr(object, cachekey, None)
+        else:
+            version = versions.get(generation_key(object), 0)
+        keys.append(make_key(templatepath, object, version))
+    return keys
+
+def get_many(keys):
+    keys = [k for k in keys if k is not None]
+    if not keys:
+        return {}
+    found = cache.get_many(keys)
+    stats['hits'] += len(found)
+    stats['misses'] += len(keys) - len(found)
+    return found
+
+def store(key, output, timeout):
+    cache.set(key, output, timeout)
+
+def invalidate(object):
+    ''' Make every cached fragment of object unreachable '''
+    if object_id(object) is not None:
+        cache.set(generation_key(object), repr(now()), GENERATION_TIMEOUT)
+
+def invalidate_handler(sender, instance, **kwargs):
+    invalidate(instance)
+
+def connect(*models):
+    ''' Invalidate the fragments of these models' instances whenever one is saved or deleted '''
+    for model in models:
+        signals.post_save.connect(invalidate_handler, sender=model)
+        signals.post_delete.connect(invalidate_handler, sender=model)
@@ -19,102 +19,311 @@ A sample listtemplate is like following:
 
 import logging
 from django import template
-from django.template.loader import render_to_string
+from django.template import TextNode
+from django.template.loader import get_template
+from django.template.defaulttags import LoadNode, CommentNode
 from django.utils.safestring import mark_safe
 from parseargshelper import parse_args_kwargs_and_as_var
+from rendertag import fragments
+from tieredcache import LRUCache
 import re
+import types
 
 
 register = template.Library()
 BASE_PATH = 'components'
 r_identifers = re.compile(r'[\w.]+')
 
-def render_object_helper(object, templatepath, listtemplate=None, template_postfix=None, context_instance=None):
+# template path -> compiled template, and template path -> True (table) / False (list)
+_templates = {}
+_table_templates = {}
+# (class, template postfix) -> template path
+_paths = {}
+
+# items rendered per cache lookup when a list is streamed
+CHUNK_SIZE = 100
+
+# dotted path -> callable, and the results of callables memoized for memo=<seconds>
+_callables = {}
+_memo = LRUCache(1000)
+_missing = object()
+MEMO_REQUEST = 'request'
+
+def get_template_path(object, template_postfix=None):
+    key = (object.__class__, template_postfix)
+    templatepath = _paths.get(key)
+    if templatepath is None:
+        templatepath = BASE_PATH + '/' + object.__class__.__name__.lower()
+        if template_postfix is not None:
+            templatepath += '_' + template_postfix.lower()
+        templatepath += '.html'
+        _paths[key] = templatepath
+        logging.debug('Render: using default template %s' % templatepath)
+    return templatepath
+
+def get_component_template(templatepath):
+    ''' Load and compile a template once, returns None if it does not exist '''
+    t = _templates.get(templatepath)
+    if t is None:
+        try:
+            t = _templates[templatepath] = get_template(templatepath)
+        except template.TemplateDoesNotExist:
+            logging.error('Render: template %s not found]' % templatepath)
+    return t
+
+def clear_template_cache():
+    _templates.clear()
+    _table_templates.clear()
+    _paths.clear()
+
+def detect_table(t):
+    '''
+    True if the template's output starts with <td, False if it doesn't, None
+    if that can't be told without rendering (e.g. it starts with {% if %})
+    '''
+    for node in t.nodelist:
+        if isinstance(node, TextNode):
+            if node.s.strip():
+                return node.s.lstrip()[:3].upper() == '<TD'
+        elif not isinstance(node, (LoadNode, CommentNode)):
+            return None
+    return False
+
+def is_list(object):
+    # generators count as lists, so that queryset.iterator() or a generator can be streamed
+    return (object.__class__.__name__ != 'dict') and (hasattr(object, '__len__') or isinstance(object, types.GeneratorType))
+
+def render_with_template(templatepath, templatecontext, context_instance):
+    t = get_component_template(templatepath)
+    if t is None:
+        return '[err: template %s not found]' % templatepath
+    context_instance.update(templatecontext)
+    try:
+        return t.render(context_instance)
+    finally:
+        context_instance.pop()
+
+def iter_chunks(objects, size):
+    chunk = []
+    for object in objects:
+        chunk.append(object)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def iter_render_list(objects, templatepath, template_postfix, context_instance, cache_timeout=None, cachekey=None,
+                     chunk_size=CHUNK_SIZE):
+    '''
+    Render every item with its component template inside one pushed context,
+    wrapped in <ul>/<li> or, for templates producing <td>s, <table>/<tr>.
+    Yields the markup piece by piece; objects are consumed chunk_size at a
+    time, so an iterator (e.g. queryset.iterator()) is never held in memory
+    as a whole. With cache_timeout, the cached fragments of each chunk are
+    fetched in bulk and only the misses are rendered.
+    '''
+    isTable = None
+    opened = False
+    context_instance.push()
+    try:
+        for chunk in iter_chunks(objects, chunk_size):
+            items = [(not is_list(item) and (templatepath or get_template_path(item, template_postfix)), item) for item in chunk]
+
+            keys = [None] * len(items)
+            cached = {}
+            if cache_timeout:
+                keys = fragments.make_keys([i for i in items if i[0]], cachekey)
+                keys.reverse()
+                keys = [itempath and keys.pop() for itempath, item in items]
+                cached = fragments.get_many(keys)
+
+            for (itempath, item), key in zip(items, keys):
+                t = None
+                if not itempath:
+                    output = render_object_helper(item, templatepath, template_postfix=template_postfix, context_instance=context_instance,
+                                                  cache_timeout=cache_timeout, cachekey=cachekey)
+                    if isTable is None:
+                        isTable = False
+                else:
+                    output = key and cached.get(key)
+                    if output is None:
+                        t = get_component_template(itempath)
+                        if t is None:
+                            output = '[err: template %s not found]' % itempath
+                            if isTable is None:
+                                isTable = False
+                        else:
+                            context_instance['object'] = item
+                            output = t.render(context_instance)
+                            if key:
+                                fragments.store(key, output, cache_timeout)
+
+                #
+                #  detect if we should use <Table> or <ul>, once for the template of the first item
+                #
+                if isTable is None:
+                    isTable = _table_templates.get(itempath)
+                    if isTable is None:
+                        isTable = t is not None and detect_table(t)
+                        if isTable is None or t is None:
+                            isTable = output.lstrip()[:3].upper() == '<TD'
+                        _table_templates[itempath] = isTable
+                if opened:
+                    yield isTable and '</tr><tr>' or '</li><li>'
+                else:
+                    yield isTable and '<table><tr>' or '<ul><li>'
+                    opened = True
+                yield output
+    finally:
+        context_instance.pop()
+
+    # generate list automatically
+    if not opened:
+        yield '<ul></ul>'
+    else:
+        yield isTable and '</tr></table>' or '</li></ul>'
+
+def render_list(objects, templatepath, template_postfix, context_instance, cache_timeout=None, cachekey=None):
+    return ''.join(iter_render_list(objects, templatepath, template_postfix, context_instance, cache_timeout, cachekey,
+                                    chunk_size=max(hasattr(objects, '__len__') and len(objects) or CHUNK_SIZE, 1)))
+
+def stream_object(object, templatepath=None, listtemplate=None, template_postfix=None, context_instance=None,
+                  cache_timeout=None, cachekey=None):
+    '''
+    Like render_object_helper, but a list is rendered lazily: returns an
+    iterator of strings that can be handed to an HttpResponse to stream it.
+    '''
+    if context_instance is None:
+        context_instance = template.Context()
+    if object is not None and is_list(object) and listtemplate is None:
+        return iter_render_list(object, templatepath, template_postfix, context_instance, cache_timeout, cachekey)
+    return iter([render_object_helper(object, templatepath, listtemplate, template_postfix, context_instance,
+                                      cache_timeout, cachekey)])
+
+def render_object_helper(object, templatepath, listtemplate=None, template_postfix=None, context_instance=None,
+                         cache_timeout=None, cachekey=None):
     ''' Render object or object list '''
-          
+
     if object is None:
         return ''
-       
-    if (object.__class__.__name__ != 'dict') and hasattr(object, '__len__'): 
+
+    if context_instance is None:
+        context_instance = template.Context()
+
+    if is_list(object):
         if listtemplate is None:
-            output =''
-            isTable = False;
-            hasDetected = False;
-            for item in object:
-                t = render_object_helper(item, templatepath, template_postfix=template_postfix, context_instance = context_instance)
-                #
-                #  detect if we should use <Table> or <ul> based on the list item
-                #
-                if not hasDetected:
-                    if t.lstrip()[:3].upper() == '<TD':
-                        isTable = True;
-                    hasDetected = True;
-                
-                # generate list automatically
-                if isTable:
-                    output += '<tr>%s</tr>' % t
-                else:
-                    output += '<li>%s</li>' % t
-            if isTable:
-                output = '<table>%s</table>' % output
-            else:
-                output = '<ul>%s</ul>' % output
-                
-            return output        
+            return mark_safe(render_list(object, templatepath, template_postfix, context_instance, cache_timeout, cachekey))
         else:
             # render the list itself with a template file
-            templatecontext = {'objects': object, 
-                               'template_name': templatepath}  # save the previous template for list 
+            templatecontext = {'objects': object,
+                               'template_name': templatepath}  # save the previous template for list
             templatepath = listtemplate
             logging.debug('Render: using list template')
-    else: 
-        if templatepath is None:  
-            templatepath = BASE_PATH + '/' + object.__class__.__name__.lower()
-            if template_postfix is not None:
-                templatepath += '_' + template_postfix.lower()
-            templatepath += '.html'
-            logging.debug('Render: using default template %s' % templatepath)
-            
+    else:
+        if templatepath is None:
+            templatepath = get_template_path(object, template_postfix)
+
+        if cache_timeout:
+            key = fragments.make_keys([(templatepath, object)], cachekey)[0]
+            output = fragments.get_many([key]).get(key)
+            if output is None:
+                output = render_with_template(templatepath, {'object': object}, context_instance)
+                if key:
+                    fragments.store(key, output, cache_timeout)
+            return mark_safe(output)
+
         templatecontext = {'object': object}
-    
-    try:      
-       output = render_to_string(templatepath, templatecontext, context_instance)
-    except template.TemplateDoesNotExist: 
-        output = '[err: template %s not found]' % templatepath
-        logging.error('Render: template %s not found]' % templatepath)         
 
-    if context_instance is not None:
-        context_instance.pop()  
-        logging.debug('pop context')
+    return mark_safe(render_with_template(templatepath, templatecontext, context_instance))
 
-    return mark_safe(output)
+def get_callable(path):
+    ''' Import the callable named by a dotted path once, raises TemplateSyntaxError if there is none '''
+    callable = _callables.get(path)
+    if callable is None:
+        if '.' not in path:
+            raise template.TemplateSyntaxError, "The arguments of tag should be either an context varible or a callable"
+        module, func = path.rsplit('.', 1)
+        try:
+            mod = __import__(module, {}, {}, [''])
+            callable = getattr(mod, func)
+        except (ImportError, AttributeError), e:
+            raise template.TemplateSyntaxError, "render: %s is neither a context varible nor a callable (%s)" % (path, e)
+        _callables[path] = callable
+    return callable
 
 class RenderObjectNode(template.Node):
-    def __init__(self, object_name, template_name=None, as_var = None, listtemplate=None, template_postfix=None):
+    def __init__(self, object_name, template_name=None, as_var = None, listtemplate=None, template_postfix=None,
+                 cache_timeout=None, cachekey=None, memo=None):
         logging.debug('Render: object=%s, template_name=%s' % (object_name, template_name))
         self.object_name = object_name 
         self.template_name = template_name
         self.as_var = as_var
         self.listtemplate = listtemplate
         self.template_postfix = template_postfix
+        self.cache_timeout = cache_timeout
+        self.cachekey = cachekey
+        self.memo = memo
+        self.variable = template.Variable(object_name)
+        self.template_variable = None
+        if template_name:
+            try:
+                self.template_variable = template.Variable(template_name)
+            except template.TemplateSyntaxError:
+                pass
+        # the callable behind object_name, imported on first use
+        self.callable = None
+        m = r_identifers.match(object_name)
+        self.callable_path = m and m.group()
     
-    def render_object(self, object, context):
+    def get_templatepath(self, context):
         if self.template_name:     
-            try:
-                templatepath = template.Variable(self.template_name).resolve(context)
-            except: 
-                templatepath = self.template_name
-        else:
-            templatepath = None
+            if self.template_variable is not None:
+                try:
+                    return self.template_variable.resolve(context)
+                except template.VariableDoesNotExist:
+                    pass
+            return self.template_name
+        return None
 
+    def render_object(self, object, context):
         return  render_object_helper(object, 
-                            templatepath, 
+                            self.get_templatepath(context), 
                             listtemplate=self.listtemplate,
                             template_postfix = self.template_postfix,
-                            context_instance = context)
+                            context_instance = context,
+                            cache_timeout = self.cache_timeout,
+                            cachekey = self.cachekey)
+
+    def call(self, context):
+        ''' Call the callable, or reuse its result within the memo scope: the request or a number of seconds '''
+        if self.callable is None:
+            if not self.callable_path:
+                raise template.TemplateSyntaxError, "The arguments of tag should be either an context varible or a callable"
+            self.callable = get_callable(self.callable_path)
+
+        if self.memo is None:
+            return self.callable()
+
+        if self.memo == MEMO_REQUEST:
+            request = context.get('request')
+            if request is None:
+                return self.callable()
+            memo = getattr(request, '_render_memo', None)
+            if memo is None:
+                memo = request._render_memo = {}
+            if self.callable_path not in memo:
+                memo[self.callable_path] = self.callable()
+            return memo[self.callable_path]
+
+        result = _memo.get(self.callable_path, _missing)
+        if result is _missing:
+            result = self.callable()
+            _memo.set(self.callable_path, result, self.memo)
+        return result
                 
-    def render_callable(self, callable, context):
-        result =  callable()
+    def render_callable(self, context):
+        result = self.call(context)
         if type(result) is str:
             return result
         else:
@@ -126,20 +335,27 @@ class RenderObjectNode(template.Node):
         
     def render(self, context):
         try: 
-            object = template.Variable(self.object_name).resolve(context)
-        except:
-            m = r_identifers.match(self.object_name)
-            if m:
-                module, func = m.group().rsplit('.', 1)
-                funcstring = self.object_name[len(module) + 1:]
-                mod = __import__(module, {}, {}, [''])
-                callable = getattr(mod, func)
-                
-                return self.render_callable(callable, context)
-            else:
-                raise template.TemplateSyntaxError, "The arguments of tag should be either an context varible or a callable"          
+            object = self.variable.resolve(context)
+        except template.VariableDoesNotExist:
+            return self.render_callable(context)
         
         return self.render_object(object, context)
+
+    def iter_render(self, context):
+        ''' render() as an iterator of strings, a list is streamed item by item '''
+        if self.as_var is not None:
+            return iter([self.render(context)])
+        try:
+            object = self.variable.resolve(context)
+        except template.VariableDoesNotExist:
+            return iter([self.render_callable(context)])
+        return stream_object(object,
+                             self.get_templatepath(context),
+                             listtemplate=self.listtemplate,
+                             template_postfix = self.template_postfix,
+                             context_instance = context,
+                             cache_timeout = self.cache_timeout,
+                             cachekey = self.cachekey)
     
 def do_render_object(parser, token):
     bits = token.split_contents()
@@ -147,10 +363,30 @@ def do_render_object(parser, token):
         raise template.TemplateSyntaxError, "%r requires at least 1 arguments" % bits[0]
     else: 
         args, kwargs, as_var = parse_args_kwargs_and_as_var(parser, bits[1:])
+        cache_timeout = kwargs.get("cache")
+        if cache_timeout is not None:
+            try:
+                cache_timeout = int(cache_timeout.strip('"\''))
+            except ValueError:
+                raise template.TemplateSyntaxError, "%r: cache must be a number of seconds" % bits[0]
+        cachekey = kwargs.get("cachekey")
+        if cachekey is not None:
+            cachekey = cachekey.strip('"\'')
+        memo = kwargs.get("memo")
+        if memo is not None:
+            memo = memo.strip('"\'')
+            if memo != MEMO_REQUEST:
+                try:
+                    memo = int(memo)
+                except ValueError:
+                    raise template.TemplateSyntaxError, "%r: memo must be 'request' or a number of seconds" % bits[0]
         return RenderObjectNode(args[0], 
                                 template_name=kwargs.get("template"), 
                                 template_postfix =kwargs.get("templatetype"),
                                 listtemplate=kwargs.get("listtemplate"),
-                                as_var = as_var)
+                                as_var = as_var,
+                                cache_timeout = cache_timeout,
+                                cachekey = cachekey,
+                                memo = memo)
 
 register.tag('render', do_render_object)
\ No newline at end of file
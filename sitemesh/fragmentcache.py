@@ -0,0 +1,232 @@
+'''
+Fragment cache for {% loadurl %}.
+
+Fragments are kept in two tiers: a small in-process LRU in front of a shared
+cache (memcache on App Engine, tieredcache's DictCache elsewhere; see
+set_backend()). An entry is (fresh until, compressed, data).
+
+  - the TTL given to the tag is jittered by +-JITTER so fragments cached at
+    the same moment don't all expire at the same moment
+  - an expired fragment is kept for STALE_TTL more seconds: the first
+    request to see it takes a lease and recomputes it, every other request
+    keeps serving the stale copy meanwhile
+  - on a full miss only the lease holder computes the fragment, the others
+    wait up to LEASE_WAIT seconds for it before computing it themselves
+  - fragments larger than COMPRESS_MIN bytes are stored zlib compressed
+  - prefetch() warms the fragments of a whole template at once: one
+    get_multi, then every miss is fetched concurrently
+
+Hit/miss/refresh counters are kept in `stats`.
+'''
+
+import hashlib
+import logging
+import random
+import threading
+import zlib
+from time import time as now, sleep
+
+from tieredcache import LRUCache, shared_cache
+
+KEY_SITEMESH = 'SITEMESH_'
+
+JITTER = 0.1
+STALE_TTL = 60 * 60
+LEASE_TTL = 30
+LEASE_WAIT = 2.0
+LEASE_POLL = 0.05
+COMPRESS_MIN = 8 * 1024
+LRU_SIZE = 200
+PREFETCH_TIMEOUT = 30
+
+stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0, 'waits': 0, 'prefetches': 0}
+_stats_lock = threading.Lock()
+
+local = LRUCache(LRU_SIZE)
+backend = shared_cache
+
+def set_backend(cache):
+    ''' Use another memcache compatible shared cache, e.g. tieredcache.DictCache() in tests '''
+    global backend
+    backend = cache
+    local.clear()
+
+def count(name):
+    _stats_lock.acquire()
+    try:
+        stats[name] += 1
+    finally:
+        _stats_lock.release()
+
+def get_stats():
+    result = dict(stats)
+    lookups = result['hits'] + result['stale_hits'] + result['misses']
+    result['hit_rate'] = lookups and float(result['hits'] + result['stale_hits']) / lookups or 0.0
+    return result
+
+def make_key(url):
+    key = KEY_SITEMESH + url
+    if len(key) > 200:
+        # memcache keys are limited to 250 bytes
+        key = KEY_SITEMESH + hashlib.md5(key).hexdigest()
+    return key
+
+def jitter(ttl):
+    if not ttl:
+        return ttl
+    return int(ttl * random.uniform(1 - JITTER, 1 + JITTER)) or 1
+
+def pack(output, ttl):
+    fresh_until = ttl and now() + ttl or 0
+    if isinstance(output, unicode):
+        output = output.encode('utf-8')
+    if len(output) >= COMPRESS_MIN:
+        return (fresh_until, True, zlib.compress(output))
+    return (fresh_until, False, output)
+
+def unpack(entry):
+    fresh_until, compressed, data = entry
+    if compressed:
+        data = zlib.decompress(data)
+    return data
+
+def is_fresh(entry):
+    return not entry[0] or entry[0] > now()
+
+def store(key, output, ttl):
+    ttl = jitter(ttl)
+    entry = pack(output, ttl)
+    time = ttl and ttl + STALE_TTL
+    backend.set(key, entry, time)
+    local.set(key, entry, time)
+
+def lookup(key):
+    entry = local.get(key)
+    if entry is None or not is_fresh(entry):
+        # the shared tier may already hold a fresher copy written by another instance
+        shared = backend.get(key)
+        if shared is not None and (entry is None or not entry[0] or shared[0] > entry[0]):
+            entry = shared
+            local.set(key, entry, entry[0] and max(entry[0] - now(), 0) + STALE_TTL)
+    return entry
+
+def compute_and_store(key, ttl, compute):
+    output = compute()
+    store(key, output, ttl)
+    return output
+
+def wait_for(key):
+    ''' Wait up to LEASE_WAIT seconds for the lease holder to store key '''
+    end = now() + LEASE_WAIT
+    while now() < end:
+        sleep(LEASE_POLL)
+        entry = lookup(key)
+        if entry is not None:
+            return entry
+    return None
+
+def get(url, ttl, compute):
+    ''' Return the cached fragment of url, compute() is called when there is none or it expired '''
+    key = make_key(url)
+    entry = lookup(key)
+
+    if entry is None:
+        count('misses')
+        if backend.add(key + '_LOCK', 1, LEASE_TTL):
+            try:
+                return compute_and_store(key, ttl, compute)
+            finally:
+                backend.delete(key + '_LOCK')
+        count('waits')
+        entry = wait_for(key)
+        if entry is None:
+            # the lease holder is taking too long, don't keep the page waiting
+            return compute_and_store(key, ttl, compute)
+        return unpack(entry)
+
+    if is_fresh(entry):
+        count('hits')
+        return unpack(entry)
+
+    count('stale_hits')
+    # only the request winning the lease refreshes, everybody else keeps serving the stale copy
+    if backend.add(key + '_LOCK', 1, LEASE_TTL):
+        count('refreshes')
+        try:
+            try:
+                return compute_and_store(key, ttl, compute)
+            except Exception, e:
+                logging.warning('sitemesh: refreshing %s failed, serving the stale copy: %s' % (url, e))
+        finally:
+            backend.delete(key + '_LOCK')
+    return unpack(entry)
+
+def is_fresh_in_cache(url):
+    entry = lookup(make_key(url))
+    return entry is not None and is_fresh(entry)
+
+def lookup_many(keys):
+    ''' {key: entry} for the keys found in either tier, one get_multi for the shared tier '''
+    found = {}
+    remote = []
+    for key in keys:
+        entry = local.get(key)
+        if entry is not None and is_fresh(entry):
+            found[key] = entry
+        else:
+            remote.append(key)
+    if remote:
+        for key, entry in backend.get_multi(remote).items():
+            found[key] = entry
+            local.set(key, entry, entry[0] and max(entry[0] - now(), 0) + STALE_TTL)
+    return found
+
+def refresh(key, ttl, compute):
+    try:
+        try:
+            compute_and_store(key, ttl, compute)
+        except Exception, e:
+            logging.warning('sitemesh: prefetching %s failed: %s' % (key, e))
+    finally:
+        backend.delete(key + '_LOCK')
+
+def prefetch(items, timeout=PREFETCH_TIMEOUT):
+    '''
+    Make sure the fragments of items, a list of (url, ttl, compute, concurrent), are cached and
+    fresh: they are looked up with one get_multi, and every missing or expired fragment this
+    request gets the lease for is computed, the concurrent ones each in its own thread while
+    the others are computed one by one in this one. Returns once all of them are done or after
+    timeout seconds; fragments that failed are left to get().
+    '''
+    keys = dict((make_key(url), (url, ttl, compute, concurrent)) for url, ttl, compute, concurrent in items)
+    found = lookup_many(keys.keys())
+
+    threads = []
+    serial = []
+    for key, (url, ttl, compute, concurrent) in keys.items():
+        entry = found.get(key)
+        if entry is not None and is_fresh(entry):
+            continue
+        if not backend.add(key + '_LOCK', 1, LEASE_TTL):
+            # somebody else is on it
+            continue
+        count('prefetches')
+        if concurrent:
+            t = threading.Thread(target=refresh, args=(key, ttl, compute))
+            t.setDaemon(True)
+            t.start()
+            threads.append(t)
+        else:
+            serial.append((key, ttl, compute))
+
+    for key, ttl, compute in serial:
+        refresh(key, ttl, compute)
+
+    end = now() + timeout
+    for t in threads:
+        t.join(max(end - now(), 0))
+
+def invalidate(url):
+    key = make_key(url)
+    backend.delete(key)
+    local.delete(key)
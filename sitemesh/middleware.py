@@ -0,0 +1,59 @@
+'''
+Assembles <esi:include src="..."/> tags in HTML responses, for running a site
+in ESI mode (settings.SITEMESH_ESI = True) without an ESI capable proxy in
+front of it, e.g. in development and tests:
+
+    MIDDLEWARE_CLASSES = (
+        'sitemesh.middleware.ESIMiddleware',
+        ...
+    )
+
+Internal URLs are rendered in-process with a sub-request, external ones are
+fetched through the transport app. Includes in included fragments are
+assembled too, up to MAX_DEPTH levels; an include of a URL that is already
+being included is dropped.
+'''
+
+import logging
+import re
+
+import transport
+from sitemesh.templatetags.sitemesh import is_extern_url, render_internal_url, RecursiveInclude
+
+MAX_DEPTH = 5
+
+r_esi_include = re.compile(r'<esi:include\s+src="([^"]*)"\s*/>')
+
+def unescape(url):
+    return url.replace('&quot;', '"').replace('&#39;', "'").replace('&lt;', '<').replace('&gt;', '>').replace('&amp;', '&')
+
+def fetch_include(url, request):
+    try:
+        if is_extern_url(url):
+            return transport.fetch(url).content
+        return render_internal_url(url, request)
+    except RecursiveInclude, e:
+        logging.error('sitemesh: recursive include: %s' % e)
+    except Exception, e:
+        logging.warning('sitemesh: esi include of %s failed: %s' % (url, e))
+    return ''
+
+def assemble(content, request, chain=()):
+    ''' Replace the includes in content, chain holds the urls of the includes content came from '''
+    if '<esi:include' not in content:
+        return content
+
+    def include(m):
+        url = unescape(m.group(1))
+        if url in chain or len(chain) >= MAX_DEPTH:
+            logging.error('sitemesh: recursive include: %s' % ' -> '.join(chain + (url,)))
+            return ''
+        return assemble(fetch_include(url, request), request, chain + (url,))
+    return r_esi_include.sub(include, content)
+
+class ESIMiddleware(object):
+    def process_response(self, request, response):
+        if 'html' not in response.get('Content-Type', ''):
+            return response
+        response.content = assemble(response.content, request)
+        return response
@@ -1,13 +1,19 @@
-from google.appengine.api import urlfetch
-from google.appengine.api import memcache
+from __future__ import absolute_import
 from django import template
-from django.core.urlresolvers import resolve
-from django.http import HttpRequest
+from django.template import TOKEN_BLOCK
+from django.conf import settings
+from django.core.urlresolvers import resolve, Resolver404
+from django.http import HttpRequest, QueryDict
 from django.http import HttpResponse
+from django.utils.html import escape
+import copy
+import logging
 import re
+import threading
+import transport
+from sitemesh import fragmentcache
  
 register = template.Library()
-KEY_SITEMESH = 'SITEMESH_'
 
 @register.tag
 def loadurl(parser, token):
@@ -19,47 +25,175 @@ def loadurl(parser, token):
     else: 
         url = ''
     
-    if param >=3:
+    if paramlen >=3:
         exptime = int(param[2])
     else:
         exptime = 0
     
-    return BlockNode(url, exptime)
+    # every loadurl of a template shares one list, so that the first one rendered can prefetch them all
+    siblings = getattr(parser, 'loadurl_nodes', None)
+    if siblings is None:
+        siblings = parser.loadurl_nodes = []
+    node = BlockNode(url, exptime, siblings, in_conditional(parser))
+    siblings.append(node)
+    return node
+
+# tags whose contents are always rendered; not block, which a template extending this one
+# may override
+UNCONDITIONAL_TAGS = ('with', 'spaceless', 'filter', 'autoescape')
+BRANCH_TAGS = ('else', 'elif', 'empty')
+
+def in_conditional(parser):
+    '''
+    Whether the tag being parsed is inside an {% if %}, {% for %} or any other tag that may
+    not render it, judging from the tags that close after it
+    '''
+    opened = []
+    for token in parser.tokens:
+        if token.token_type != TOKEN_BLOCK or not token.contents.strip():
+            continue
+        name = token.contents.split()[0]
+        if name.startswith('end'):
+            name = name[3:]
+            if name in opened:
+                opened.reverse()
+                opened.remove(name)
+                opened.reverse()
+            elif name not in UNCONDITIONAL_TAGS:
+                return True
+        elif name in BRANCH_TAGS:
+            if not [n for n in opened if n.startswith('if') or n == 'for']:
+                return True
+        else:
+            opened.append(name)
+    return False
+
+def render_state(context):
+    ''' Per render storage: render_context where there is one, the outermost context dict otherwise '''
+    state = getattr(context, 'render_context', None)
+    if state is None:
+        state = context.dicts[-1]
+    return state
     
-def fetch_internal_url(url, context):
-    resolved = resolve(url)   
+# path -> (view_func, args, kwargs), or None for paths that don't resolve
+_views = {}
+
+# includes deeper than this are cut off, as are URLs that include themselves
+MAX_DEPTH = 5
+_includes = threading.local()
+
+class RecursiveInclude(Exception):
+    pass
+
+def resolve_view(path):
+    if path not in _views:
+        try:
+            _views[path] = resolve(path)
+        except Resolver404:
+            _views[path] = None
+    return _views[path]
+
+def make_subrequest(request, url):
+    ''' A GET request for url that carries over request's user, session, cookies and headers '''
+    path, query = (url.split('?', 1) + [''])[:2]
+    if request is None:
+        sub = HttpRequest()
+        sub.META = {}
+    else:
+        sub = copy.copy(request)
+        sub.META = dict(request.META)
+        # merged GET/POST of the outer request, if it was cached
+        sub.__dict__.pop('_request', None)
+    sub.path = sub.path_info = path
+    sub.method = 'GET'
+    sub.GET = QueryDict(query)
+    sub.POST = QueryDict('')
+    sub.META.update({'PATH_INFO': path, 'QUERY_STRING': query, 'REQUEST_METHOD': 'GET'})
+    return sub
+
+def render_internal_url(url, request):
+    ''' Call the view of an internal url in-process with a sub-request of request '''
+    path = url.split('?', 1)[0]
+    resolved = resolve_view(path)
     if resolved is None: 
         return ''
     view_func, args, kw = resolved
-    
-    if (hasattr(context, 'request')):
-        request = context['request']
-    else:
-        request = HttpRequest()
-        
-    response = view_func(request, *args, **kw)
+
+    stack = getattr(_includes, 'stack', None)
+    outermost = stack is None
+    if outermost:
+        stack = _includes.stack = []
+        if request is not None:
+            stack.append(request.path)
+    if path in stack or len(stack) > MAX_DEPTH:
+        raise RecursiveInclude('%s includes %s' % (' -> '.join(stack), path))
+
+    stack.append(path)
+    try:
+        response = view_func(make_subrequest(request, url), *args, **kw)
+    finally:
+        stack.pop()
+        if outermost:
+            del _includes.stack
     return response.content
 
+def fetch_internal_url(url, context):
+    return render_internal_url(url, context.get('request'))
+
+def esi_include(url):
+    return '<esi:include src="%s"/>' % escape(url)
+
+def esi_enabled():
+    return getattr(settings, 'SITEMESH_ESI', False)
+
 def is_extern_url(url):
     p = re.compile('http://', re.IGNORECASE)    
     return (p.match(url) is not None)
           
 
 class BlockNode(template.Node): 
-    def __init__(self, url, exptime):
+    def __init__(self, url, exptime, siblings=None, conditional=False):
         self.url = url
         self.exptime = exptime
+        if siblings is None:
+            siblings = [self]
+        self.siblings = siblings
+        self.conditional = conditional
         
     def render(self, context):   
-        output = memcache.get(KEY_SITEMESH+self.url)
-        
-        if output is None: 
-            if (is_extern_url(self.url)):
-                result = urlfetch.fetch(self.url)            
-                output = result.content
-            else:
-                output = fetch_internal_url(self.url, context)
-            # add to cache
-            memcache.add(KEY_SITEMESH+self.url, output, self.exptime)
-        
-        return output
\ No newline at end of file
+        if esi_enabled():
+            # leave it to the caching proxy in front (or to middleware.ESIMiddleware)
+            return esi_include(self.url)
+        self.prefetch(context)
+        try:
+            return fragmentcache.get(self.url, self.exptime, self.get_fetch(context))
+        except RecursiveInclude, e:
+            # not cached: the same url may well be fine where it isn't included recursively
+            logging.error('sitemesh: recursive include: %s' % e)
+            return ''
+
+    def prefetch(self, context):
+        '''
+        On the first cold fragment of a render, fetch it and the template's other fragments in
+        one go, so a cold page takes as long as its slowest fragment rather than the sum of all
+        of them. Fragments inside {% if %}, {% for %} and the like are left out, they may not be
+        rendered at all.
+        '''
+        state = render_state(context)
+        flag = ('sitemesh_prefetched', id(self.siblings))
+        if flag in state or fragmentcache.is_fresh_in_cache(self.url):
+            return
+        state[flag] = True
+        nodes = [node for node in self.siblings if not node.conditional or node is self]
+        if len(nodes) > 1:
+            fragmentcache.prefetch([(node.url, node.exptime, node.get_fetch(context), is_extern_url(node.url))
+                                    for node in nodes])
+
+    def get_fetch(self, context):
+        return lambda: self.fetch(context)
+
+    def fetch(self, context):
+        if (is_extern_url(self.url)):
+            result = transport.fetch(self.url)            
+            return result.content
+        return fetch_internal_url(self.url, context)
@@ -0,0 +1,162 @@
+'''
+Small caching building blocks shared by the apps in this library.
+
+  LRUCache      bounded in-process cache with per entry expiry
+  DictCache     dict-backed stand-in for the App Engine memcache API
+  shared_cache  App Engine memcache when available, a process wide
+                DictCache otherwise
+
+Only the subset of the memcache API used here is implemented: get, set,
+add, delete, get_multi, set_multi and incr. Expiry times are relative
+seconds, 0 means never expire.
+'''
+
+import threading
+from collections import OrderedDict
+from time import time as now
+
+try:
+    from google.appengine.api import memcache
+except ImportError:
+    memcache = None
+
+class LRUCache(object):
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.RLock()
+
+    def get(self, key, default=None):
+        self.lock.acquire()
+        try:
+            if key not in self.data:
+                return default
+            value, expires = self.data.pop(key)
+            if expires and expires <= now():
+                return default
+            self.data[key] = (value, expires)
+            return value
+        finally:
+            self.lock.release()
+
+    def set(self, key, value, time=0):
+        self.lock.acquire()
+        try:
+            if key in self.data:
+                del self.data[key]
+            elif len(self.data) >= self.maxsize:
+                self.data.popitem(last=False)
+            self.data[key] = (value, time and now() + time)
+        finally:
+            self.lock.release()
+
+    def delete(self, key):
+        self.lock.acquire()
+        try:
+            self.data.pop(key, None)
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.data.clear()
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self.data)
+
+class DictCache(object):
+    ''' memcache compatible cache kept in a local dict, for tests and non-GAE deployments '''
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.RLock()
+
+    def _get(self, key):
+        if key in self.data:
+            value, expires = self.data[key]
+            if not expires or expires > now():
+                return value
+            del self.data[key]
+        return None
+
+    def get(self, key):
+        self.lock.acquire()
+        try:
+            return self._get(key)
+        finally:
+            self.lock.release()
+
+    def get_multi(self, keys, key_prefix=''):
+        self.lock.acquire()
+        try:
+            result = {}
+            for key in keys:
+                value = self._get(key_prefix + key)
+                if value is not None:
+                    result[key] = value
+            return result
+        finally:
+            self.lock.release()
+
+    def set(self, key, value, time=0):
+        self.lock.acquire()
+        try:
+            self.data[key] = (value, time and now() + time)
+            return True
+        finally:
+            self.lock.release()
+
+    def set_multi(self, mapping, time=0, key_prefix=''):
+        for key, value in mapping.items():
+            self.set(key_prefix + key, value, time)
+        return []
+
+    def add(self, key, value, time=0):
+        self.lock.acquire()
+        try:
+            if self._get(key) is not None:
+                return False
+            return self.set(key, value, time)
+        finally:
+            self.lock.release()
+
+    def delete(self, key):
+        self.lock.acquire()
+        try:
+            if self._get(key) is None:
+                return 1
+            del self.data[key]
+            return 2
+        finally:
+            self.lock.release()
+
+    def incr(self, key, delta=1, initial_value=None):
+        self.lock.acquire()
+        try:
+            value = self._get(key)
+            if value is None:
+                if initial_value is None:
+                    return None
+                value = initial_value
+            value += delta
+            expires = key in self.data and self.data[key][1] or 0
+            self.data[key] = (value, expires)
+            return value
+        finally:
+            self.lock.release()
+
+    def flush_all(self):
+        self.lock.acquire()
+        try:
+            self.data.clear()
+            return True
+        finally:
+            self.lock.release()
+
+if memcache is not None:
+    shared_cache = memcache
+else:
+    shared_cache = DictCache()
@@ -0,0 +1,158 @@
+'''
+HTTP transport shared by urlinfo, PageRank and sitemesh.
+
+    import transport
+
+    response = transport.fetch('http://example.com/', deadline=5)
+    response.status, response.headers, response.content
+
+    response = transport.stream(url)
+    response.status, response.headers
+    for chunk in response:
+        ...
+
+Requests go through a pluggable backend (see transport.backends): App Engine
+urlfetch when available, otherwise a pooled httplib client that keeps
+connections to each host alive between requests. On top of the backend this
+module adds
+
+  - gzip: requests are sent with Accept-Encoding: gzip and decoded here
+  - size limit: bodies larger than max_bytes raise ResponseTooLarge
+  - retries: connection errors and 5xx responses are retried up to
+    `retries` times, sleeping backoff * 2^attempt seconds with random jitter
+
+set_backend(transport.backends.FakeBackend({...})) serves canned responses
+in tests.
+'''
+
+import logging
+import random
+import time
+import zlib
+
+from backends import UrlfetchBackend, PooledBackend, FakeBackend, urlfetch
+
+DEFAULT_DEADLINE = 10
+MAX_BYTES = 4 * 1024 * 1024
+RETRIES = 2
+BACKOFF = 0.1
+CHUNK_SIZE = 8192
+
+HEADERS = {
+    'Accept-Encoding': 'gzip',
+    'User-Agent': 'Mozilla/5.0 (compatible; reusable-transport)',
+}
+
+class TransportError(Exception):
+    pass
+
+class ResponseTooLarge(TransportError):
+    pass
+
+class Response(object):
+    def __init__(self, url, status, headers, content):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.content = content
+
+class Stream(object):
+    ''' A response whose body is read while iterating over it '''
+
+    def __init__(self, url, raw, max_bytes=MAX_BYTES):
+        self.url = url
+        self.status = raw.status
+        self.headers = raw.headers
+        self.raw = raw
+        self.chunks = read_chunks(raw, max_bytes)
+
+    def __iter__(self):
+        return self.chunks
+
+    def close(self):
+        # the generator's own cleanup only runs once it has been started
+        self.chunks.close()
+        self.raw.close()
+
+if urlfetch is not None:
+    _backend = UrlfetchBackend(deadline=DEFAULT_DEADLINE)
+else:
+    _backend = PooledBackend(read_timeout=DEFAULT_DEADLINE)
+
+def set_backend(backend):
+    ''' Replace the backend, returns the previous one '''
+    global _backend
+    previous = _backend
+    _backend = backend
+    return previous
+
+def get_backend():
+    return _backend
+
+def sleep_before_retry(attempt, backoff):
+    # full jitter keeps retries of many clients from hitting the upstream in lockstep
+    time.sleep(random.uniform(0, backoff * (2 ** attempt)))
+
+def open_url(url, deadline=None, retries=RETRIES, backoff=BACKOFF, headers=None):
+    ''' Returns the backend's raw response, retrying connection errors and 5xx '''
+    request_headers = dict(HEADERS)
+    if headers:
+        request_headers.update(headers)
+
+    attempt = 0
+    while True:
+        try:
+            # None leaves it to the backend's own default
+            raw = _backend.open(url, request_headers, deadline)
+        except Exception, e:
+            if attempt >= retries:
+                raise TransportError('%s: %s' % (url, e))
+            logging.info('transport: %s failed (%s), retrying' % (url, e))
+        else:
+            if raw.status < 500 or attempt >= retries:
+                return raw
+            raw.close()
+            logging.info('transport: %s returned %d, retrying' % (url, raw.status))
+        sleep_before_retry(attempt, backoff)
+        attempt += 1
+
+def read_chunks(raw, max_bytes=MAX_BYTES, chunk_size=CHUNK_SIZE):
+    ''' Yields the decoded body, raises ResponseTooLarge past max_bytes '''
+    decoder = None
+    if raw.headers.get('content-encoding', '').lower() == 'gzip':
+        decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    size = 0
+    try:
+        while True:
+            chunk = raw.read(chunk_size)
+            if not chunk:
+                break
+            if decoder is not None:
+                chunk = decoder.decompress(chunk)
+            size += len(chunk)
+            if max_bytes and size > max_bytes:
+                raise ResponseTooLarge('response larger than %d bytes' % max_bytes)
+            if chunk:
+                yield chunk
+        if decoder is not None:
+            chunk = decoder.flush()
+            if max_bytes and size + len(chunk) > max_bytes:
+                raise ResponseTooLarge('response larger than %d bytes' % max_bytes)
+            if chunk:
+                yield chunk
+    finally:
+        raw.close()
+
+def fetch(url, deadline=None, max_bytes=MAX_BYTES, retries=RETRIES, headers=None):
+    raw = open_url(url, deadline, retries, headers=headers)
+    content = ''.join(read_chunks(raw, max_bytes))
+    return Response(url, raw.status, raw.headers, content)
+
+def stream(url, deadline=None, max_bytes=MAX_BYTES, retries=RETRIES, headers=None):
+    '''
+    Returns a Stream: status and headers are there right away, iterating over it yields the
+    body chunk by chunk, closing the response as soon as the caller stops
+    '''
+    raw = open_url(url, deadline, retries, headers=headers)
+    return Stream(url, raw, max_bytes)
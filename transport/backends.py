@@ -0,0 +1,252 @@
+'''
+Transport backends.
+
+A backend has one method, open(url, headers, timeout), returning a raw
+response object with `status`, `headers` (dict with lower case names),
+read(size) and close(). timeout is the deadline of the whole request in
+seconds, None for the backend's default. The transport module takes care of
+retries, gzip decoding and size limits on top of it.
+
+  UrlfetchBackend   App Engine urlfetch service
+  PooledBackend     httplib with per host keep-alive connection pools
+  FakeBackend       canned in-memory responses, for tests
+'''
+
+import httplib
+import socket
+import threading
+import time
+import urlparse
+from StringIO import StringIO
+
+try:
+    from google.appengine.api import urlfetch
+except ImportError:
+    urlfetch = None
+
+class RawResponse(object):
+    ''' A response whose body is already in memory '''
+
+    def __init__(self, status, headers, content):
+        self.status = status
+        self.headers = headers
+        self.body = StringIO(content)
+
+    def read(self, size=-1):
+        return self.body.read(size)
+
+    def close(self):
+        pass
+
+class UrlfetchBackend(object):
+    ''' urlfetch keeps its own connections, all we can set is the deadline '''
+
+    def __init__(self, deadline=10):
+        self.deadline = deadline
+
+    def open(self, url, headers, timeout):
+        result = urlfetch.fetch(url, headers=headers, deadline=timeout or self.deadline)
+        headers = dict((k.lower(), v) for k, v in result.headers.items())
+        return RawResponse(result.status_code, headers, result.content)
+
+class Watchdog(object):
+    '''
+    Shuts the socket down at the deadline, which makes a read blocked on it return. A socket
+    timeout only bounds each recv(), so an upstream trickling in a byte at a time would
+    never hit it.
+    '''
+
+    def __init__(self, sock, timeout):
+        self.sock = sock
+        self.expired = False
+        self.cancelled = False
+        self.lock = threading.Lock()
+        self.timer = threading.Timer(timeout, self.expire)
+        self.timer.setDaemon(True)
+        self.timer.start()
+
+    def expire(self):
+        self.lock.acquire()
+        try:
+            if self.cancelled:
+                return
+            self.expired = True
+        finally:
+            self.lock.release()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+    def cancel(self):
+        ''' Returns whether the socket is still usable '''
+        self.timer.cancel()
+        self.lock.acquire()
+        try:
+            self.cancelled = True
+            return not self.expired
+        finally:
+            self.lock.release()
+
+class PooledResponse(object):
+    '''
+    Gives the connection back to its pool once the body has been read completely. Reading
+    past the deadline raises socket.timeout.
+    '''
+
+    def __init__(self, backend, key, conn, watchdog, response):
+        self.backend = backend
+        self.key = key
+        self.conn = conn
+        self.watchdog = watchdog
+        self.response = response
+        self.status = response.status
+        self.headers = dict(response.getheaders())
+
+    def read(self, size=-1):
+        try:
+            if size < 0:
+                data = self.response.read()
+            else:
+                data = self.response.read(size)
+        except (httplib.HTTPException, IOError):
+            if self.watchdog.expired:
+                raise socket.timeout('deadline exceeded')
+            raise
+        # the body may have been cut short
+        if self.watchdog.expired:
+            raise socket.timeout('deadline exceeded')
+        return data
+
+    def close(self):
+        if self.conn is None:
+            return
+        usable = self.watchdog.cancel()
+        if usable and self.response.isclosed() and not self.response.will_close:
+            self.backend.release(self.key, self.conn)
+        else:
+            # unread data left on the socket, the connection can't be reused
+            self.response.close()
+            self.conn.close()
+        self.conn = None
+
+class PooledBackend(object):
+    '''
+    read_timeout is the deadline of a request unless open() is given one: the time from
+    sending it until the last byte of the body, redirects included.
+    '''
+
+    def __init__(self, max_per_host=4, connect_timeout=5, read_timeout=10, max_redirects=5):
+        self.max_per_host = max_per_host
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_redirects = max_redirects
+        self.pools = {}
+        self.lock = threading.Lock()
+        self.stats = {'connects': 0, 'reuses': 0}
+
+    def acquire(self, key):
+        self.lock.acquire()
+        try:
+            pool = self.pools.get(key)
+            if pool:
+                self.stats['reuses'] += 1
+                return pool.pop(), True
+            self.stats['connects'] += 1
+        finally:
+            self.lock.release()
+
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(host, port, timeout=self.connect_timeout)
+        else:
+            conn = httplib.HTTPConnection(host, port, timeout=self.connect_timeout)
+        return conn, False
+
+    def release(self, key, conn):
+        self.lock.acquire()
+        try:
+            pool = self.pools.setdefault(key, [])
+            if len(pool) < self.max_per_host:
+                pool.append(conn)
+                return
+        finally:
+            self.lock.release()
+        conn.close()
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            for pool in self.pools.values():
+                for conn in pool:
+                    conn.close()
+            self.pools.clear()
+        finally:
+            self.lock.release()
+
+    def request(self, key, path, headers, deadline):
+        conn, reused = self.acquire(key)
+        watchdog = None
+        try:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise socket.timeout('deadline exceeded')
+            if conn.sock is None:
+                conn.connect()
+            conn.sock.settimeout(remaining)
+            watchdog = Watchdog(conn.sock, remaining)
+            conn.request('GET', path, headers=headers)
+            return conn, watchdog, conn.getresponse()
+        except (httplib.HTTPException, IOError):
+            conn.close()
+            if watchdog is not None and not watchdog.cancel():
+                raise socket.timeout('deadline exceeded')
+            if not reused:
+                raise
+        # the server dropped an idle keep-alive connection, try once more on a new one
+        return self.request(key, path, headers, deadline)
+
+    def open(self, url, headers, timeout):
+        deadline = time.time() + (timeout or self.read_timeout)
+        for i in range(self.max_redirects + 1):
+            parts = urlparse.urlsplit(url)
+            port = parts.port or (parts.scheme == 'https' and 443 or 80)
+            key = (parts.scheme, parts.hostname, port)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+
+            conn, watchdog, response = self.request(key, path, headers, deadline)
+            result = PooledResponse(self, key, conn, watchdog, response)
+            location = result.headers.get('location')
+            if result.status in (301, 302, 303, 307) and location:
+                result.read()
+                result.close()
+                url = urlparse.urljoin(url, location)
+                continue
+            return result
+        return result
+
+class FakeBackend(object):
+    '''
+    Serves canned responses: responses maps url to a body string, to a
+    (status, body) or (status, body, headers) tuple, or to a callable
+    returning one of those. Unknown urls are 404. Requested urls are
+    appended to `requests`.
+    '''
+
+    def __init__(self, responses=None):
+        self.responses = responses or {}
+        self.requests = []
+
+    def open(self, url, headers, timeout):
+        self.requests.append(url)
+        response = self.responses.get(url, (404, ''))
+        if callable(response):
+            response = response(url)
+        if isinstance(response, basestring):
+            response = (200, response)
+        if len(response) == 2:
+            response = response + ({},)
+        status, content, headers = response
+        return RawResponse(status, dict((k.lower(), v) for k, v in headers.items()), content)
@@ -0,0 +1,99 @@
+'''
+Run a batch of blocking calls concurrently on a small thread pool.
+
+    results = run({'a': (func, (arg1, arg2)), 'b': (func2, ())}, timeout=20)
+
+returns a dict with the same keys, each value is
+
+    {'status': 'ok' | 'error' | 'timeout', 'value': ..., 'latency': <ms>}
+
+run() returns once every call has finished or the overall timeout has
+passed, whichever is first, so the wall time follows the slowest call and
+not the sum of all of them. At the timeout the calls that haven't started
+yet are dropped; the ones still running are left to finish in the
+background, their results are discarded. Both are reported as 'timeout'.
+With wait=True run() waits for the calls in flight instead and reports
+their results, so that the calls of one batch never overlap the next one.
+
+DEFAULT_DEADLINE bounds one attempt of an upstream fetch, not the call: the
+transport retries a failed attempt up to transport.RETRIES times, so a call
+can take (RETRIES + 1) times the deadline plus the backoff in between. The
+overall timeout is what bounds the batch.
+'''
+
+import logging
+import threading
+import time
+import Queue
+
+DEFAULT_DEADLINE = 10   # seconds, each attempt of an upstream fetch
+DEFAULT_TIMEOUT = 20    # seconds, the whole batch
+MAX_WORKERS = 32
+
+def _worker(queue, results, done, cancelled):
+    while not cancelled.isSet():
+        try:
+            key, func, args = queue.get_nowait()
+        except Queue.Empty:
+            return
+
+        start = time.time()
+        try:
+            result = {'status': 'ok', 'value': func(*args)}
+        except Exception, e:
+            logging.warning('batch: %r failed: %s' % (key, e))
+            result = {'status': 'error', 'value': None}
+        result['latency'] = int((time.time() - start) * 1000)
+
+        done.acquire()
+        try:
+            results[key] = result
+            done.notify()
+        finally:
+            done.release()
+
+def run(tasks, timeout=DEFAULT_TIMEOUT, max_workers=MAX_WORKERS, wait=False):
+    ''' tasks: dict of key -> (callable, args) '''
+    queue = Queue.Queue()
+    for key, (func, args) in tasks.items():
+        queue.put((key, func, args))
+
+    results = {}
+    done = threading.Condition()
+    cancelled = threading.Event()
+    workers = []
+    for i in range(min(len(tasks), max_workers)):
+        t = threading.Thread(target=_worker, args=(queue, results, done, cancelled))
+        t.setDaemon(True)
+        t.start()
+        workers.append(t)
+
+    end = time.time() + timeout
+    done.acquire()
+    try:
+        while len(results) < len(tasks):
+            remaining = end - time.time()
+            if remaining <= 0:
+                break
+            done.wait(remaining)
+        finished = dict(results)
+    finally:
+        done.release()
+
+    # the calls that haven't started by now never will
+    cancelled.set()
+    while True:
+        try:
+            queue.get_nowait()
+        except Queue.Empty:
+            break
+    if wait:
+        for t in workers:
+            t.join()
+        finished = dict(results)
+
+    elapsed = int(timeout * 1000)
+    for key in tasks:
+        if key not in finished:
+            finished[key] = {'status': 'timeout', 'value': None, 'latency': elapsed}
+    return finished
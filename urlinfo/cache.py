@@ -0,0 +1,162 @@
+'''
+Result cache for the urlinfo metrics.
+
+Values are kept in two tiers: a small in-process LRU in front of the shared
+cache (memcache on App Engine, tieredcache's DictCache elsewhere), keyed by
+(metric, normalized site).
+
+  - every metric has its own TTL, see METRIC_TTL; a TTL can also be a
+    function of the value
+  - failures ("?") are cached too, but only for NEGATIVE_TTL
+  - once a value is older than its TTL it is still served for up to
+    STALE_TTL more seconds while a single background worker refreshes it
+    (stale-while-revalidate); only a full miss blocks the caller
+  - a refresh that fails (e.g. the upstream's circuit breaker is open)
+    keeps the old value instead of replacing it with "?"
+
+Hit/miss/refresh counters are kept in `stats`.
+'''
+
+import logging
+import threading
+import hashlib
+from time import time as now
+
+from tieredcache import LRUCache, shared_cache
+
+KEY_URLINFO = 'URLINFO_'
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+DEFAULT_TTL = DAY
+METRIC_TTL = {
+    'gpr': 7 * DAY,
+    'whois': 30 * DAY,
+    'w3chtml': 6 * HOUR,
+    'w3ccss': 6 * HOUR,
+}
+NEGATIVE_TTL = 5 * 60
+STALE_TTL = 7 * DAY
+LOCK_TTL = 60
+LRU_SIZE = 500
+
+FAILED = '?'
+
+stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0, 'negative': 0}
+_stats_lock = threading.Lock()
+
+local = LRUCache(LRU_SIZE)
+backend = shared_cache
+
+def set_backend(cache):
+    ''' Use another memcache compatible shared cache, e.g. tieredcache.DictCache() in tests '''
+    global backend
+    backend = cache
+    local.clear()
+
+def count(name):
+    _stats_lock.acquire()
+    try:
+        stats[name] += 1
+    finally:
+        _stats_lock.release()
+
+def get_stats():
+    result = dict(stats)
+    lookups = result['hits'] + result['stale_hits'] + result['misses']
+    result['hit_rate'] = lookups and float(result['hits'] + result['stale_hits']) / lookups or 0.0
+    return result
+
+def normalize_site(site):
+    site = site.strip().lower()
+    if site.startswith('http://'):
+        site = site[7:]
+    elif site.startswith('https://'):
+        site = site[8:]
+    return site.rstrip('/')
+
+def make_key(metric, site):
+    key = '%s%s_%s' % (KEY_URLINFO, metric, normalize_site(site))
+    if len(key) > 200:
+        # memcache keys are limited to 250 bytes
+        key = KEY_URLINFO + hashlib.md5(key).hexdigest()
+    return key
+
+def ttl_for(metric, value):
+    if value == FAILED:
+        return NEGATIVE_TTL
+    ttl = METRIC_TTL.get(metric, DEFAULT_TTL)
+    if callable(ttl):
+        # the TTL depends on the value, e.g. on a whois record's expiry date
+        ttl = ttl(value)
+    return ttl
+
+def store(metric, site, value):
+    ''' Store value, an entry is (value, fresh until) '''
+    ttl = ttl_for(metric, value)
+    entry = (value, now() + ttl)
+    key = make_key(metric, site)
+    backend.set(key, entry, ttl + STALE_TTL)
+    local.set(key, entry, ttl + STALE_TTL)
+    if value == FAILED:
+        count('negative')
+
+def lookup(key):
+    entry = local.get(key)
+    if entry is None or entry[1] <= now():
+        # the shared tier may already hold a fresher value written by another instance
+        shared = backend.get(key)
+        if shared is not None and (entry is None or shared[1] > entry[1]):
+            entry = shared
+            local.set(key, entry, max(entry[1] - now(), 0) + STALE_TTL)
+    return entry
+
+def refresh(metric, site, compute, stale=None):
+    key = make_key(metric, site)
+    try:
+        try:
+            value = compute()
+            if value == FAILED and stale not in (None, FAILED):
+                # keep serving the old value rather than replacing it with a failure,
+                # try again after NEGATIVE_TTL
+                entry = (stale, now() + NEGATIVE_TTL)
+                backend.set(key, entry, NEGATIVE_TTL + STALE_TTL)
+                local.set(key, entry, NEGATIVE_TTL + STALE_TTL)
+                count('negative')
+                return
+            store(metric, site, value)
+        except Exception, e:
+            logging.warning('urlinfo cache: refreshing %s failed: %s' % (key, e))
+    finally:
+        backend.delete(key + '_LOCK')
+
+def get(metric, site, compute):
+    ''' Return the cached value of metric for site, compute() is called on a miss '''
+    key = make_key(metric, site)
+    entry = lookup(key)
+
+    if entry is None:
+        count('misses')
+        value = compute()
+        store(metric, site, value)
+        return value
+
+    value, fresh_until = entry
+    if fresh_until > now():
+        count('hits')
+        return value
+
+    count('stale_hits')
+    # only the request winning the lock refreshes, everybody else keeps serving the stale value
+    if backend.add(key + '_LOCK', 1, LOCK_TTL):
+        count('refreshes')
+        t = threading.Thread(target=refresh, args=(metric, site, compute, value))
+        t.setDaemon(True)
+        t.start()
+    return value
+
+def invalidate(metric, site):
+    key = make_key(metric, site)
+    backend.delete(key)
+    local.delete(key)
@@ -0,0 +1,64 @@
+'''
+Fetch layer used by the urlinfo scrapers.
+
+Every upstream request made by urlinfo goes through fetch(url, deadline) or
+stream(url, deadline). By default both use the shared transport module
+(pooled keep-alive connections, retries, gzip); its backend can be replaced
+with transport.set_backend(), e.g. a transport.backends.FakeBackend in tests.
+A completely different fetch function can be plugged in here as well:
+
+    from urlinfo import fetch
+    fetch.set_fetcher(my_fetch)
+
+Both are run through the scheduler, which rate limits every upstream host,
+caps its concurrent requests and short-circuits hosts whose circuit breaker
+is open (see urlinfo/scheduler.py).
+
+A fetcher is any callable taking (url, deadline) and returning the response
+body as a string. deadline is in seconds, None means the backend default.
+
+stream(url, deadline) yields the body in chunks instead, so callers can stop
+reading early. Fetchers without a matching streamer have their whole body
+split into chunks.
+'''
+
+import transport
+import scheduler
+
+CHUNK_SIZE = 8192
+
+def transport_fetch(url, deadline=None):
+    response = transport.fetch(url, deadline)
+    if response.status >= 500:
+        # an error page would scrape as "0", report it as a failure instead
+        raise transport.TransportError('%s returned %d' % (url, response.status))
+    return response.content
+
+def transport_stream(url, deadline=None):
+    response = transport.stream(url, deadline)
+    if response.status >= 500:
+        response.close()
+        raise transport.TransportError('%s returned %d' % (url, response.status))
+    return response
+
+_fetcher, _streamer = transport_fetch, transport_stream
+
+def set_fetcher(fetcher, streamer=None):
+    ''' Replace the fetch backend, returns the previous (fetcher, streamer) '''
+    global _fetcher, _streamer
+    previous = (_fetcher, _streamer)
+    _fetcher, _streamer = fetcher, streamer
+    return previous
+
+def get_fetcher():
+    return _fetcher
+
+def fetch(url, deadline=None):
+    return scheduler.call(url, _fetcher, url, deadline)
+
+def chunked(url, deadline=None):
+    content = _fetcher(url, deadline)
+    return (content[i:i + CHUNK_SIZE] for i in xrange(0, len(content), CHUNK_SIZE))
+
+def stream(url, deadline=None):
+    return scheduler.call_stream(url, _streamer or chunked, url, deadline)
@@ -0,0 +1,38 @@
+'''
+The urlinfo metrics, independent of the views so batch jobs can use them.
+'''
+
+from PageRank import PageRankURL, ParsePageRank
+from fetch import fetch
+import scrapers
+import cache
+import store
+import whoislookup
+
+# page ranks
+def PageRank(site, deadline=None):
+    return ParsePageRank(fetch(PageRankURL(site), deadline))
+
+#whois
+def WhoisOwner(site, deadline=None):
+    record = whoislookup.lookup(site, deadline, ('owner',))
+    if record == cache.FAILED:
+        return record
+    return record['owner'] or ''
+
+def FetchMetric(metric, site, deadline=None):
+    ''' Fetch one metric for a site from upstream, returns it as a string '''
+    if metric == 'gpr':
+        return str(PageRank(site, deadline))
+    if metric == 'whois':
+        return WhoisOwner(site, deadline)
+    return scrapers.get(metric).scrape(site, deadline)
+
+def Metric(metric, site, deadline=None):
+    ''' Look up one metric for a site: precomputed store first, then the result cache '''
+    value = store.latest(metric, cache.normalize_site(site))
+    if value is not None:
+        return value
+    return cache.get(metric, site, lambda: FetchMetric(metric, site, deadline))
+
+METRICS = sorted(scrapers.SCRAPERS.keys() + ['gpr', 'whois'])
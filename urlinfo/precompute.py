@@ -0,0 +1,77 @@
+'''
+Refresh the urlinfo metrics of a list of watched sites into the store.
+
+    python -m urlinfo.precompute watchlist.txt [metric,metric,...]
+
+(with DJANGO_SETTINGS_MODULE pointing at settings that define URLINFO_STORE)
+The watch list has one site per line, blank lines and lines starting with #
+are ignored. Run it from cron; the views then answer from the store without
+any upstream traffic.
+
+Sites are processed BATCH_SIZE at a time, every metric of a batch is fetched
+concurrently with at most CONCURRENCY requests in flight (the per host limits
+of the scheduler apply on top of that). A batch that runs into TIMEOUT starts
+no more fetches, and the next batch waits for the ones in flight, whose
+results are still stored.
+'''
+
+import logging
+import sys
+
+from urlinfo import batch, store
+from urlinfo.metrics import FetchMetric, METRICS
+from urlinfo.cache import normalize_site, FAILED
+
+BATCH_SIZE = 20
+CONCURRENCY = 8
+TIMEOUT = 120
+
+def read_watchlist(path):
+    sites = []
+    for line in open(path):
+        line = line.strip()
+        if line and not line.startswith('#'):
+            sites.append(normalize_site(line))
+    return sites
+
+def refresh(sites, metrics=None, batch_size=BATCH_SIZE, concurrency=CONCURRENCY, timeout=TIMEOUT):
+    ''' Fetch and store every metric of every site, returns (stored, failed) counts '''
+    if metrics is None:
+        metrics = METRICS
+    stored = failed = 0
+    for i in range(0, len(sites), batch_size):
+        tasks = {}
+        for site in sites[i:i + batch_size]:
+            for metric in metrics:
+                tasks[(metric, site)] = (FetchMetric, (metric, site))
+
+        results = batch.run(tasks, timeout=timeout, max_workers=concurrency, wait=True)
+
+        good = []
+        for (metric, site), result in results.items():
+            if result['status'] == 'ok' and result['value'] not in (None, FAILED):
+                good.append((metric, site, result['value']))
+            else:
+                failed += 1
+        store.record_many(good)
+        stored += len(good)
+        logging.info('precompute: %d/%d sites done' % (min(i + batch_size, len(sites)), len(sites)))
+    return stored, failed
+
+def main(argv):
+    if len(argv) < 2:
+        print 'usage: %s watchlist.txt [metric,metric,...]' % argv[0]
+        return 2
+    if not store.enabled():
+        print 'the urlinfo store is not configured, set URLINFO_STORE in the settings'
+        return 1
+    metrics = None
+    if len(argv) > 2:
+        metrics = [m for m in argv[2].split(',') if m in METRICS]
+    stored, failed = refresh(read_watchlist(argv[1]), metrics)
+    print '%d values stored, %d failed' % (stored, failed)
+    return 0
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv))
@@ -0,0 +1,244 @@
+'''
+Per upstream host scheduling for the urlinfo fetches.
+
+Each upstream host gets
+
+  - a token bucket rate limit (RATE requests/second, bursts of BURST)
+  - a concurrency cap (MAX_CONCURRENCY requests in flight)
+  - a circuit breaker: after FAILURE_THRESHOLD consecutive errors or
+    timeouts it opens and every call fails at once with CircuitOpen. After
+    RESET_TIMEOUT seconds one probe request is let through (half-open); if
+    it succeeds the breaker closes again, otherwise it re-opens.
+
+A call that can't get a token and a slot within QUEUE_TIMEOUT fails with
+Overloaded instead of tying up the worker. Per host settings can be
+overridden in LIMITS. status() returns breaker state and queue depth of
+every host seen so far.
+'''
+
+import threading
+import urlparse
+from time import time as now, sleep
+
+RATE = 5.0
+BURST = 10
+MAX_CONCURRENCY = 4
+QUEUE_TIMEOUT = 5
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 60
+
+# host -> dict overriding any of rate, burst, max_concurrency, failure_threshold, reset_timeout
+LIMITS = {
+    'www.google.com': {'rate': 2.0, 'burst': 5},
+}
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+class CircuitOpen(Exception):
+    pass
+
+class Overloaded(Exception):
+    pass
+
+class TokenBucket(object):
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now()
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout):
+        end = now() + timeout
+        while True:
+            self.lock.acquire()
+            try:
+                t = now()
+                self.tokens = min(self.burst, self.tokens + (t - self.updated) * self.rate)
+                self.updated = t
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            finally:
+                self.lock.release()
+            if now() + wait > end:
+                return False
+            sleep(wait)
+
+class CircuitBreaker(object):
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        self.lock.acquire()
+        try:
+            if self.state == OPEN and now() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self.probing = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self.probing:
+                # let exactly one probe through
+                self.probing = True
+                return True
+            return False
+        finally:
+            self.lock.release()
+
+    def success(self):
+        self.lock.acquire()
+        try:
+            self.state = CLOSED
+            self.failures = 0
+            self.probing = False
+        finally:
+            self.lock.release()
+
+    def cancel(self):
+        ''' The allowed call never reached the upstream '''
+        self.lock.acquire()
+        try:
+            self.probing = False
+        finally:
+            self.lock.release()
+
+    def failure(self):
+        self.lock.acquire()
+        try:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = now()
+                self.probing = False
+        finally:
+            self.lock.release()
+
+class Upstream(object):
+    def __init__(self, host, rate=RATE, burst=BURST, max_concurrency=MAX_CONCURRENCY,
+                 failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.host = host
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.queued = 0
+        self.slots = threading.Condition()
+
+    def enter(self, timeout):
+        end = now() + timeout
+        self.slots.acquire()
+        try:
+            self.queued += 1
+            try:
+                while self.in_flight >= self.max_concurrency:
+                    remaining = end - now()
+                    if remaining <= 0:
+                        raise Overloaded('%s: %d requests in flight' % (self.host, self.in_flight))
+                    self.slots.wait(remaining)
+                self.in_flight += 1
+            finally:
+                self.queued -= 1
+        finally:
+            self.slots.release()
+
+        if not self.bucket.acquire(max(end - now(), 0)):
+            self.leave()
+            raise Overloaded('%s: rate limit' % self.host)
+
+    def leave(self):
+        self.slots.acquire()
+        try:
+            self.in_flight -= 1
+            self.slots.notify()
+        finally:
+            self.slots.release()
+
+    def status(self):
+        return {
+            'state': self.breaker.state,
+            'failures': self.breaker.failures,
+            'in_flight': self.in_flight,
+            'queued': self.queued,
+        }
+
+_upstreams = {}
+_lock = threading.Lock()
+
+def get_upstream(url):
+    host = urlparse.urlsplit(url).hostname or ''
+    _lock.acquire()
+    try:
+        upstream = _upstreams.get(host)
+        if upstream is None:
+            upstream = _upstreams[host] = Upstream(host, **LIMITS.get(host, {}))
+        return upstream
+    finally:
+        _lock.release()
+
+def call(url, func, *args):
+    ''' Run func(*args) for a request to url under its host's limits and breaker '''
+    upstream = get_upstream(url)
+    if not upstream.breaker.allow():
+        raise CircuitOpen(upstream.host)
+    try:
+        upstream.enter(QUEUE_TIMEOUT)
+    except Overloaded:
+        upstream.breaker.cancel()
+        raise
+    try:
+        try:
+            result = func(*args)
+        except Exception:
+            upstream.breaker.failure()
+            raise
+        upstream.breaker.success()
+        return result
+    finally:
+        upstream.leave()
+
+def call_stream(url, func, *args):
+    ''' Like call() for a function returning chunks, the slot is held until they are consumed '''
+    upstream = get_upstream(url)
+    if not upstream.breaker.allow():
+        raise CircuitOpen(upstream.host)
+    try:
+        upstream.enter(QUEUE_TIMEOUT)
+    except Overloaded:
+        upstream.breaker.cancel()
+        raise
+    try:
+        try:
+            for chunk in func(*args):
+                yield chunk
+        except GeneratorExit:
+            # the reader stopped early, which is fine
+            upstream.breaker.success()
+            raise
+        except Exception:
+            upstream.breaker.failure()
+            raise
+        upstream.breaker.success()
+    finally:
+        upstream.leave()
+
+def status():
+    _lock.acquire()
+    try:
+        upstreams = _upstreams.items()
+    finally:
+        _lock.release()
+    return dict((host, upstream.status()) for host, upstream in upstreams)
+
+def reset():
+    _lock.acquire()
+    try:
+        _upstreams.clear()
+    finally:
+        _lock.release()
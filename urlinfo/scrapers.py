@@ -0,0 +1,109 @@
+'''
+Registry of the search result scrapers used by urlinfo.
+
+A scraper is pure data: a url template, a pattern with a named group and a
+normalizer for the matched text. Patterns are compiled once, when this module
+is imported. Adding a metric means adding one register() call here, the
+views, the batch endpoint and the cache pick it up from the registry.
+
+Pages are read with fetch.stream() and scanned while they arrive, reading
+stops as soon as the pattern has matched or MAX_BYTES have been read.
+Each new chunk is searched together with the last OVERLAP bytes before it,
+so a match is only found if it is at most OVERLAP bytes long. Patterns that
+can match more than that, e.g. across lines with \D* or on long lines with
+.*, are registered with multiline=True: they're searched in the whole
+buffer every time, which costs more but finds every match.
+'''
+
+import re
+from fetch import stream
+
+MAX_BYTES = 256 * 1024
+
+# a new chunk is scanned together with this many bytes of the previous ones,
+# so a match may not be longer than that unless the scraper is multiline
+OVERLAP = 1024
+
+def number(value):
+    value = value.strip()
+    return value or '0'
+
+def text(value):
+    return value.strip()
+
+class Scraper(object):
+    def __init__(self, name, url, pattern, group='number', normalize=number, max_bytes=MAX_BYTES,
+                 multiline=False):
+        self.name = name
+        self.url = url
+        self.pattern = re.compile(pattern)
+        self.group = group
+        self.normalize = normalize
+        self.max_bytes = max_bytes
+        self.overlap = not multiline and OVERLAP or None
+
+    def get_url(self, site):
+        return self.url % {'site': site}
+
+    def scrape(self, site, deadline=None):
+        ''' Returns the normalized value, "0" if there's no match and "?" on errors '''
+        try:
+            m = scan(stream(self.get_url(site), deadline), self.pattern, self.max_bytes, self.overlap)
+            if m is None:
+                return '0'
+            return self.normalize(m.group(self.group))
+        except:
+            return '?'
+
+def scan(chunks, pattern, max_bytes=MAX_BYTES, overlap=OVERLAP):
+    '''
+    Search pattern in the chunks as they arrive, returns the match object or None. Each
+    chunk is searched with overlap bytes of the previous ones, the whole buffer if it's None.
+    '''
+    buf = ''
+    m = None
+    for chunk in chunks:
+        start = overlap is not None and max(len(buf) - overlap, 0) or 0
+        buf += chunk
+        m = pattern.search(buf, start)
+        # a match running up to the end of the buffer may continue in the next chunk
+        if m is not None and m.end() < len(buf):
+            break
+        if len(buf) >= max_bytes:
+            break
+    return m
+
+SCRAPERS = {}
+
+def register(name, url, pattern, **kwargs):
+    SCRAPERS[name] = Scraper(name, url, pattern, **kwargs)
+
+def get(name):
+    return SCRAPERS[name]
+
+#  Google.com's indexed pages and links
+register('gpages', 'http://www.google.com/search?q=site:%(site)s', '<b>(?P<number>[\d,]*)</b> from <b>')
+register('glinks', 'http://www.google.com/search?q=link:%(site)s', '<b>(?P<number>[\d,]*)</b> linking to')
+
+#  Microsoft Live.com search, "Advanced search keywords"
+#    site: Returns webpages that belong to the specified site.
+#    inanchor: These keywords return webpages that contain the specified term in the metadata
+register('livepages', 'http://search.live.com/results.aspx?q=site:%(site)s', 'of (?P<number>[\d,]*) result')
+register('livelinks', 'http://search.live.com/results.aspx?q=inanchor:%(site)s', 'of (?P<number>[\d,]*) result')
+
+# baidu; \D* runs across lines, for any number of bytes
+register('baidupages', 'http://www.baidu.com/s?wd=site:%(site)s', '<td align="right" nowrap>\D*(?P<number>[\d,]*)', multiline=True)
+register('baidulinks', 'http://www.baidu.com/s?wd=inurl:%(site)s', '<td align="right" nowrap>\D*(?P<number>[\d,]*)', multiline=True)
+
+# yahoo
+register('ypages', 'http://siteexplorer.search.yahoo.com/search?p=http://%(site)s', 'Pages \((?P<number>[\d,]*)')
+register('ylinks', 'http://siteexplorer.search.yahoo.com/search?p=http://%(site)s', 'Inlinks \((?P<number>[\d,]*)')
+
+register('delicious', 'http://del.icio.us/url/check?url=http://%(site)s', 'class="savers(\d*)">(?P<number>[\d,]*)')
+register('reddit', 'http://www.reddit.com/search?q=%(site)s', 'class="summary">about (?P<number>[\d,]*)')
+#register('digg', 'http://digg.com/search?submit=Search&section=news&type=url&area=all&sort=new&s=%(site)s', 'class="summary">about (?P<number>[\d,]*)')
+register('stumbleupon', 'http://www.stumbleupon.com/url/%(site)s', 'class="textOk">(?P<number>[\d,]*)')
+
+# .* takes the rest of the line, which can be longer than OVERLAP
+register('w3chtml', 'http://validator.w3.org/check?uri=http://%(site)s', '<h2 id="results"(?P<number>.*)</h2>', normalize=text, multiline=True)
+register('w3ccss', 'http://jigsaw.w3.org/css-validator/validator?uri=%(site)s', '<h3>(?P<number>.*)</h3>', normalize=text, multiline=True)
@@ -0,0 +1,106 @@
+'''
+Time-series store of precomputed urlinfo metrics, kept in SQLite.
+
+Values are stored run-length encoded: a row is (metric, site, first_seen,
+last_seen, value) and a refresh that returns the same value only moves
+last_seen, so a metric that changes once a week costs one row a week no
+matter how often it is refreshed.
+
+The store is used when settings.URLINFO_STORE names a database file (or
+when set_path() is called); on App Engine, where sqlite3 is not available,
+it stays disabled and every lookup misses.
+'''
+
+import threading
+from time import time as now
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+try:
+    from django.conf import settings
+    PATH = getattr(settings, 'URLINFO_STORE', None)
+except Exception:
+    PATH = None
+
+# a stored value older than this is not served by latest()
+MAX_AGE = 24 * 60 * 60
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS snapshots (
+    metric TEXT NOT NULL,
+    site TEXT NOT NULL,
+    first_seen INTEGER NOT NULL,
+    last_seen INTEGER NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_lookup ON snapshots (metric, site, last_seen);
+'''
+
+_local = threading.local()
+# bumped by set_path(), every thread reconnects when it sees a new one
+_generation = 0
+
+def set_path(path):
+    global PATH, _generation
+    PATH = path
+    _generation += 1
+
+def enabled():
+    return sqlite3 is not None and PATH is not None
+
+def connection():
+    # sqlite connections can't be shared between threads, nor closed by another one
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.generation != _generation:
+        conn.close()
+        conn = None
+    if conn is None:
+        conn = _local.conn = sqlite3.connect(PATH)
+        _local.generation = _generation
+        conn.executescript(SCHEMA)
+    return conn
+
+def latest_row(conn, metric, site):
+    return conn.execute('SELECT rowid, value, last_seen FROM snapshots WHERE metric = ? AND site = ? '
+                        'ORDER BY last_seen DESC LIMIT 1', (metric, site)).fetchone()
+
+def record(metric, site, value, timestamp=None):
+    if not enabled():
+        return
+    timestamp = int(timestamp or now())
+    value = unicode(value)
+    conn = connection()
+    row = latest_row(conn, metric, site)
+    if row is not None and row[1] == value:
+        conn.execute('UPDATE snapshots SET last_seen = ? WHERE rowid = ?', (timestamp, row[0]))
+    else:
+        conn.execute('INSERT INTO snapshots (metric, site, first_seen, last_seen, value) VALUES (?, ?, ?, ?, ?)',
+                     (metric, site, timestamp, timestamp, value))
+    conn.commit()
+
+def record_many(results, timestamp=None):
+    ''' results: iterable of (metric, site, value) '''
+    for metric, site, value in results:
+        record(metric, site, value, timestamp)
+
+def latest(metric, site, max_age=MAX_AGE):
+    ''' The last stored value if it was seen within max_age seconds, otherwise None '''
+    if not enabled():
+        return None
+    row = latest_row(connection(), metric, site)
+    if row is None or row[2] < now() - max_age:
+        return None
+    return row[1]
+
+def history(metric, site, since=0, limit=1000):
+    ''' [(first_seen, last_seen, value), ...], oldest first '''
+    if not enabled():
+        return []
+    rows = connection().execute('SELECT first_seen, last_seen, value FROM snapshots '
+                                'WHERE metric = ? AND site = ? AND last_seen >= ? '
+                                'ORDER BY last_seen DESC LIMIT ?', (metric, site, int(since), limit)).fetchall()
+    rows.reverse()
+    return rows
@@ -24,4 +24,10 @@ urlpatterns = patterns('',
     (r'^w3ccss/(.*)$', w3ccss),
        
     (r'^whois/(.*)$', whois),    
+    (r'^whoisinfo/(.*)$', whoisinfo),
+
+    (r'^all/(.*)$', allmetrics),
+    (r'^cachestats/$', cachestats),
+    (r'^upstreams/$', upstreams),
+    (r'^history/(\w+)/(.*)$', history),
 )
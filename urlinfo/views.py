@@ -1,102 +1,161 @@
 # -*- coding: utf-8 -*-
 import re
 from django.utils.html import escape
-from google.appengine.api import urlfetch
+from django.utils import simplejson
 from django.http import HttpResponse, HttpResponseRedirect
 
-from PageRank import PageRank 
-from xml.etree.ElementTree import XML
-
-def ScrapeSearchResult(url, regex, groupname):
-    try: 
-        result = urlfetch.fetch(url)
-        p =re.compile(regex)
-        f = p.search(result.content)
-        if (f != None): 
+from fetch import stream
+from metrics import PageRank, WhoisOwner, FetchMetric, Metric, METRICS
+import scrapers
+import batch
+import cache
+import scheduler
+import store
+import whoislookup
+
+def ScrapeSearchResult(url, regex, groupname, deadline=None):
+    try:
+        f = scrapers.scan(stream(url, deadline), re.compile(regex))
+        if (f != None):
             res = f.group(groupname)
-        else: 
+        else:
             res = "0"
     except:
         res = "?"
-         
-    return res  
-#
-#  Google.com's indexed pages and links
-#  
+
+    return res
+
 def gpages(request, site):
-    res = ScrapeSearchResult('http://www.google.com/search?q=site:' + site, '<b>(?P<number>[\d,]*)</b> from <b>', 'number')   
-    return HttpResponse(res)
+    return HttpResponse(Metric('gpages', site))
 
 def glinks(request, site):
-    res = ScrapeSearchResult('http://www.google.com/search?q=link:' + site, '<b>(?P<number>[\d,]*)</b> linking to', 'number')   
-    return HttpResponse(res)
+    return HttpResponse(Metric('glinks', site))
 
-#  Microsoft Live.com search, "Advanced search keywords"
-#    site: Returns webpages that belong to the specified site. 
-#    inanchor: These keywords return webpages that contain the specified term in the metadata
 def livepages(request, site):
-    res = ScrapeSearchResult('http://search.live.com/results.aspx?q=site:' + site, 'of (?P<number>[\d,]*) result', 'number')   
-    return HttpResponse(res)
+    return HttpResponse(Metric('livepages', site))
 
 def livelinks(request, site):
-    res = ScrapeSearchResult('http://search.live.com/results.aspx?q=inanchor:' + site, 'of (?P<number>[\d,]*) result', 'number')   
-    return HttpResponse(res)
+    return HttpResponse(Metric('livelinks', site))
 
-# baidu
 def baidupages(request, site):
-    res = ScrapeSearchResult('http://www.baidu.com/s?wd=site:' + site, '<td align="right" nowrap>\D*(?P<number>[\d,]*)', 'number')   
-    return HttpResponse(res)
+    return HttpResponse(Metric('baidupages', site))
 
 def baidulinks(request, site):
-    res = ScrapeSearchResult('http://www.baidu.com/s?wd=inurl:' + site, '<td align="right" nowrap>\D*(?P<number>[\d,]*)', 'number')   
-    return HttpResponse(res)
+    return HttpResponse(Metric('baidulinks', site))
 
-# yahoo
 def ypages(request, site):
-    res = ScrapeSearchResult('http://siteexplorer.search.yahoo.com/search?p=http://' + site, 'Pages \((?P<number>[\d,]*)', 'number')   
-    return HttpResponse(res)
+    return HttpResponse(Metric('ypages', site))
 
 def ylinks(request, site):
-    res = ScrapeSearchResult('http://siteexplorer.search.yahoo.com/search?p=http://' + site, 'Inlinks \((?P<number>[\d,]*)', 'number')   
-    return HttpResponse(res)
+    return HttpResponse(Metric('ylinks', site))
 
 def delicious(request, site):
-    res = ScrapeSearchResult('http://del.icio.us/url/check?url=http://' + site, 'class="savers(\d*)">(?P<number>[\d,]*)', 'number')   
-    return HttpResponse(res)
-    
-def reddit(request, site):
-    res = ScrapeSearchResult('http://www.reddit.com/search?q=' + site, 'class="summary">about (?P<number>[\d,]*)', 'number')   
-    return HttpResponse(res)
-
-#===============================================================================
-# def digg(request, site):
-#    res = ScrapeSearchResult('http://digg.com/search?submit=Search&section=news&type=url&area=all&sort=new&s=' + site, 'class="summary">about (?P<number>[\d,]*)', 'number')   
-#    return HttpResponse(res)
-#===============================================================================
+    return HttpResponse(Metric('delicious', site))
 
+def reddit(request, site):
+    return HttpResponse(Metric('reddit', site))
 
 def w3chtml(request, site):
-    res = ScrapeSearchResult('http://validator.w3.org/check?uri=http://' + site, '<h2 id="results"(?P<number>.*)</h2>', 'number')   
-    return HttpResponse(res)
+    return HttpResponse(Metric('w3chtml', site))
 
 def w3ccss(request, site):
-    res = ScrapeSearchResult('http://jigsaw.w3.org/css-validator/validator?uri=' + site, '<h3>(?P<number>.*)</h3>', 'number')   
-    return HttpResponse(res)
-
+    return HttpResponse(Metric('w3ccss', site))
 
 def stumbleupon(request, site):
-    res = ScrapeSearchResult('http://www.stumbleupon.com/url/' + site, 'class="textOk">(?P<number>[\d,]*)', 'number')   
-    return HttpResponse(res)
-
+    return HttpResponse(Metric('stumbleupon', site))
 
-# page ranks
 def gpr(request, site):
-    res = str(PageRank(site))
-    return HttpResponse(res)
+    return HttpResponse(Metric('gpr', site))
 
-#whois 
 def whois(request, site):
-    result = urlfetch.fetch('http://www.trynt.com/whois-api/v1/?f=0&h=' + site)
-    whoisres = XML(result.content)
-    name = whoisres.find('Whois/regrinfo/owner/name').text
-    return HttpResponse(name) 
+    return HttpResponse(Metric('whois', site))
+
+#
+#  All metrics in one request, every upstream is fetched concurrently
+#
+#    /all/<site>              one site
+#    /all/?sites=a,b,c        several sites
+#
+#  optional GET parameters:
+#    metrics=gpr,gpages,...   only these metrics
+#    deadline=<seconds>       deadline of each attempt of an upstream fetch (they're retried)
+#    timeout=<seconds>        overall deadline, unfinished metrics are reported as 'timeout'
+#
+def allmetrics(request, site):
+    if site:
+        sites = [site]
+    else:
+        sites = [s for s in request.GET.get('sites', '').split(',') if s]
+
+    metrics = METRICS
+    if request.GET.get('metrics'):
+        metrics = [m for m in request.GET['metrics'].split(',') if m in METRICS]
+
+    try:
+        deadline = float(request.GET.get('deadline', batch.DEFAULT_DEADLINE))
+        timeout = float(request.GET.get('timeout', batch.DEFAULT_TIMEOUT))
+    except ValueError:
+        deadline, timeout = batch.DEFAULT_DEADLINE, batch.DEFAULT_TIMEOUT
+
+    tasks = {}
+    for s in sites:
+        for m in metrics:
+            tasks[(s, m)] = (Metric, (m, s, deadline))
+
+    results = batch.run(tasks, timeout=timeout)
+
+    res = {}
+    for (s, m), result in results.items():
+        if result['value'] == '?':
+            result['status'] = 'error'
+        res.setdefault(s, {})[m] = result
+    return HttpResponse(simplejson.dumps(res), mimetype='application/json')
+
+def cachestats(request):
+    return HttpResponse(simplejson.dumps(cache.get_stats()), mimetype='application/json')
+
+def upstreams(request):
+    return HttpResponse(simplejson.dumps(scheduler.status()), mimetype='application/json')
+
+#
+#  Stored history of a metric, filled by the precompute job
+#
+#    /history/<metric>/<site>?since=<unix time>
+#
+def history(request, metric, site):
+    try:
+        since = int(request.GET.get('since', 0))
+    except ValueError:
+        since = 0
+    rows = store.history(metric, cache.normalize_site(site), since)
+    res = [{'from': first, 'to': last, 'value': value} for first, last, value in rows]
+    return HttpResponse(simplejson.dumps(res), mimetype='application/json')
+
+#
+#  Whois records as JSON
+#
+#    /whoisinfo/<domain>
+#    /whoisinfo/?domains=a.com,b.com      several domains, looked up concurrently
+#
+#  optional: fields=owner,registrar,created,expires (default owner,registrar,expires)
+#
+def whoisinfo(request, domain):
+    if domain:
+        domains = [domain]
+    else:
+        domains = [d for d in request.GET.get('domains', '').split(',') if d]
+
+    fields = whoislookup.DEFAULT_FIELDS
+    if request.GET.get('fields'):
+        fields = [f for f in request.GET['fields'].split(',') if f in whoislookup.FIELDS]
+
+    tasks = dict((d, (whoislookup.lookup, (d, None, fields))) for d in domains)
+    results = batch.run(tasks)
+
+    res = {}
+    for d, result in results.items():
+        if result['status'] == 'ok' and result['value'] != cache.FAILED:
+            res[d] = result['value']
+        else:
+            res[d] = None
+    return HttpResponse(simplejson.dumps(res), mimetype='application/json')
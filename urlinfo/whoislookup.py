@@ -0,0 +1,117 @@
+'''
+Whois records from the trynt.com whois API.
+
+The XML response is parsed incrementally with iterparse while it streams in;
+every element is cleared once it's closed and reading stops as soon as all
+requested fields have been found, so memory per lookup stays flat however
+large the response is.
+
+    lookup('example.com')
+    -> {'owner': 'Example Inc.', 'registrar': 'Example Registrar', 'expires': '2012-08-13'}
+
+Fields that are not in the response are None, a lookup that fails returns
+"?". Records are cached through urlinfo.cache; the TTL follows the expiry
+date, so a domain about to expire is looked up again soon after.
+'''
+
+import datetime
+import time
+from xml.etree.ElementTree import iterparse
+
+from fetch import stream
+import cache
+
+WHOIS_URL = 'http://www.trynt.com/whois-api/v1/?f=0&h=%s'
+
+# field name -> element path below the document root
+FIELDS = {
+    'owner': 'Whois/regrinfo/owner/name',
+    'registrar': 'Whois/regyinfo/registrar',
+    'created': 'Whois/regrinfo/domain/created',
+    'expires': 'Whois/regrinfo/domain/expires',
+}
+DEFAULT_FIELDS = ('owner', 'registrar', 'expires')
+
+MIN_TTL = 60 * 60
+MAX_TTL = 30 * cache.DAY
+
+DATE_FORMATS = ('%Y-%m-%d', '%d-%b-%Y', '%Y.%m.%d', '%d.%m.%Y', '%Y/%m/%d')
+
+class ChunkReader(object):
+    ''' File-like object over an iterator of chunks, for iterparse '''
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buf = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buf) < size:
+            try:
+                self.buf += self.chunks.next()
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self.buf)
+        data, self.buf = self.buf[:size], self.buf[size:]
+        return data
+
+def parse(chunks, fields=DEFAULT_FIELDS):
+    ''' Extract fields from the streamed XML, returns {field: text or None} '''
+    wanted = dict((FIELDS[f], f) for f in fields)
+    record = dict((f, None) for f in fields)
+    path = []
+    root = None
+    for event, elem in iterparse(ChunkReader(chunks), events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            else:
+                path.append(elem.tag)
+            continue
+
+        if elem is root:
+            break
+        name = wanted.pop('/'.join(path), None)
+        if name is not None:
+            record[name] = elem.text and elem.text.strip()
+            if not wanted:
+                break
+        path.pop()
+        elem.clear()
+        if not path:
+            # drop finished top level elements from the root as well
+            root.clear()
+    return record
+
+def parse_date(text):
+    if not text:
+        return None
+    text = text.strip()[:11].strip()
+    for format in DATE_FORMATS:
+        try:
+            return datetime.datetime(*time.strptime(text, format)[:6])
+        except ValueError:
+            pass
+    return None
+
+def record_ttl(record):
+    ''' Cache a record until shortly after the domain expires, at most MAX_TTL '''
+    expires = parse_date(record.get('expires'))
+    if expires is None:
+        return MAX_TTL
+    seconds = (expires - datetime.datetime.utcnow()).days * cache.DAY
+    return min(max(seconds, MIN_TTL), MAX_TTL)
+
+cache.METRIC_TTL['whois-record'] = record_ttl
+
+def fetch_record(domain, deadline=None):
+    try:
+        return parse(stream(WHOIS_URL % domain, deadline), FIELDS.keys())
+    except Exception:
+        return cache.FAILED
+
+def lookup(domain, deadline=None, fields=DEFAULT_FIELDS):
+    record = cache.get('whois-record', domain, lambda: fetch_record(domain, deadline))
+    if record == cache.FAILED:
+        return record
+    return dict((f, record.get(f)) for f in fields)